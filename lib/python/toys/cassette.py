@@ -0,0 +1,197 @@
+'''
+Record and replay HTTP sessions (cassettes) for offline testing.
+
+A cassette is a file containing one JSON encoded interaction per line.
+Cassettes are recorded by running any of the tools with TOYS_HTTP_RECORD
+set to the cassette filename and replayed by setting TOYS_HTTP_REPLAY
+instead (see toys.http.install()). When replaying:
+
+ * TOYS_HTTP_LATENCY injects a delay before each response. It is either
+   a number of seconds or 'recorded' to reproduce the delay observed
+   when the cassette was recorded.
+ * TOYS_HTTP_STATS names a file to which the number of requests and
+   bytes transferred are written when the process exits.
+
+Credentials are removed from interactions before they are written to
+disk (see sanitize()) so cassettes can be shared.
+'''
+
+import atexit
+import base64
+import collections
+import json
+import os
+import time
+
+try:
+	from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+	from urllib import urlencode
+	from urlparse import parse_qsl, urlsplit, urlunsplit
+
+import requests
+import requests.adapters
+
+import toys.http
+
+# Request and response headers that carry credentials
+secret_headers = ( 'authorization', 'api-key', 'api-username', 'cookie',
+		   'set-cookie', 'x-csrf-token' )
+
+# Query parameters that carry credentials
+secret_params = ( 'api_key', 'api_username', 'access_token', 'password',
+		  'token' )
+
+REDACTED = 'REDACTED'
+
+def sanitize_url(url):
+	parts = urlsplit(url)
+	if not parts.query:
+		return url
+	query = [ (k, REDACTED if k.lower() in secret_params else v)
+			for k, v in parse_qsl(parts.query, keep_blank_values=True) ]
+	return urlunsplit(parts._replace(query=urlencode(query)))
+
+def sanitize_headers(headers):
+	return dict((k, REDACTED if k.lower() in secret_headers else v)
+			for k, v in headers.items())
+
+def sanitize(interaction):
+	'''Remove credentials from a recorded interaction.'''
+	interaction = dict(interaction)
+	interaction['url'] = sanitize_url(interaction['url'])
+	interaction['request_headers'] = sanitize_headers(
+			interaction['request_headers'])
+	interaction['headers'] = sanitize_headers(interaction['headers'])
+	return interaction
+
+def encode_body(body):
+	try:
+		return ('utf-8', body.decode('UTF-8'))
+	except UnicodeDecodeError:
+		return ('base64', base64.b64encode(body).decode('ascii'))
+
+def decode_body(encoding, body):
+	if encoding == 'base64':
+		return base64.b64decode(body)
+	return body.encode('UTF-8')
+
+def load(fname):
+	with open(fname, 'r') as f:
+		return [ json.loads(ln) for ln in f if ln.strip() ]
+
+def save(fname, interactions):
+	with open(fname, 'w') as f:
+		for i in interactions:
+			f.write(json.dumps(i, sort_keys=True) + '\n')
+
+class Stats(object):
+	'''Track the requests made so they can be reported at exit.'''
+	def __init__(self, fname=None):
+		self.requests = 0
+		self.bytes = 0
+		self.misses = 0
+		if fname:
+			atexit.register(self.save, fname)
+
+	def save(self, fname):
+		with open(fname, 'w') as f:
+			json.dump({ 'requests': self.requests, 'bytes': self.bytes,
+				    'misses': self.misses }, f)
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+	'''Transport adapter that appends every interaction to a cassette.'''
+	_instances = {}
+
+	def __init__(self, fname, **kwargs):
+		super(RecordingAdapter, self).__init__(**kwargs)
+		self.fname = fname
+		self.stats = Stats(os.environ.get('TOYS_HTTP_STATS'))
+
+	@staticmethod
+	def from_environ(**kwargs):
+		fname = os.environ['TOYS_HTTP_RECORD']
+		if fname not in RecordingAdapter._instances:
+			RecordingAdapter._instances[fname] = \
+				RecordingAdapter(fname, **kwargs)
+		return RecordingAdapter._instances[fname]
+
+	def send(self, request, **kwargs):
+		response = super(RecordingAdapter, self).send(request, **kwargs)
+
+		(encoding, body) = encode_body(response.content)
+		headers = dict((k, v) for k, v in response.headers.items()
+			if k not in toys.http.CachingAdapter.dropped_headers)
+		interaction = sanitize({
+			'method': request.method,
+			'url': request.url,
+			'request_headers': dict(request.headers),
+			'status': response.status_code,
+			'reason': response.reason,
+			'headers': headers,
+			'encoding': encoding,
+			'body': body,
+			'elapsed': response.elapsed.total_seconds(),
+		})
+		with open(self.fname, 'a') as f:
+			f.write(json.dumps(interaction, sort_keys=True) + '\n')
+
+		self.stats.requests += 1
+		self.stats.bytes += len(response.content)
+		return response
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+	'''Transport adapter that answers requests from a cassette.
+
+	Interactions are matched using the method and (sanitized) URL.
+	Repeated requests for the same URL are answered in the order they
+	were recorded with the final answer being re-used if the cassette
+	runs dry.
+	'''
+	_instances = {}
+
+	def __init__(self, fname, latency=None, stats=None):
+		super(ReplayAdapter, self).__init__()
+		self.interactions = collections.defaultdict(collections.deque)
+		for i in load(fname):
+			self.interactions[(i['method'], i['url'])].append(i)
+		self.latency = latency
+		self.stats = stats if stats else Stats()
+
+	@staticmethod
+	def from_environ():
+		fname = os.environ['TOYS_HTTP_REPLAY']
+		if fname not in ReplayAdapter._instances:
+			latency = os.environ.get('TOYS_HTTP_LATENCY')
+			if latency and latency != 'recorded':
+				latency = float(latency)
+			ReplayAdapter._instances[fname] = ReplayAdapter(fname,
+				latency=latency,
+				stats=Stats(os.environ.get('TOYS_HTTP_STATS')))
+		return ReplayAdapter._instances[fname]
+
+	def send(self, request, **kwargs):
+		self.stats.requests += 1
+
+		queue = self.interactions.get(
+				(request.method, sanitize_url(request.url)))
+		if not queue:
+			self.stats.misses += 1
+			raise requests.ConnectionError(
+				'{} {} is not in the cassette'.format(
+					request.method, request.url),
+				request=request)
+		i = queue.popleft() if len(queue) > 1 else queue[0]
+
+		if self.latency == 'recorded':
+			time.sleep(i['elapsed'])
+		elif self.latency:
+			time.sleep(self.latency)
+
+		body = decode_body(i['encoding'], i['body'])
+		self.stats.bytes += len(body)
+		return toys.http.build_response(request, i['status'],
+				i['reason'], i['headers'], body, self)
+
+	def close(self):
+		pass
@@ -2,14 +2,42 @@
 Simplified charting library based on matplotlib.
 
 Works best with data sets prepared using toys.collect
+
+matplotlib takes a long time to import so it is not imported until
+something is actually drawn. Charts can also be drawn without it using
+the native SVG backend in toys.svg, which is used for any filename ending
+in .svg. Set TOYS_CHART=svg in the environment to use it for PNG files
+too (if there is a rasterizer to convert the SVG).
 '''
 
 import hashlib
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import os
 
 import toys.collect as collect
+import toys.trace as trace
+
+def pyplot():
+	'''Import (and configure) matplotlib.pyplot on first use.'''
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	return plt
+
+def svg():
+	'''Import the native SVG backend on first use.
+
+	It needs xml.sax.saxutils which, in turn, imports most of urllib,
+	http.client and ssl.
+	'''
+	import toys.svg
+	return toys.svg
+
+def use_svg(filename):
+	'''Decide whether to draw a chart using the native SVG backend.'''
+	if filename.endswith('.svg'):
+		return True
+	return os.environ.get('TOYS_CHART') == 'svg' and \
+	       svg().rasterizer() is not None
 
 def get_colour(s):
 	override = {
@@ -30,7 +58,13 @@ def get_colour(s):
 
 	return '#{}'.format(hashlib.md5(str(s).encode('UTF-8')).hexdigest()[-6:])
 
+@trace.traced('chart.stacked_barchart')
 def stacked_barchart(things, filename, title=None, xlabel=None, ylabel=None):
+	if use_svg(filename):
+		return svg().stacked_barchart(things, filename, get_colour,
+				title=title, xlabel=xlabel, ylabel=ylabel)
+
+	plt = pyplot()
 	x_labels = sorted(things.keys())
 
 	legend_labels = set()
@@ -68,6 +102,7 @@ def stacked_barchart(things, filename, title=None, xlabel=None, ylabel=None):
 	plt.savefig(filename, bbox_extra_artists=(lgd,), bbox_inches='tight')
 	plt.close()
 
+@trace.traced('chart.piechart')
 def piechart(things, filename, title=None):
 	labels = None
 	if isinstance(things, dict):
@@ -77,6 +112,11 @@ def piechart(things, filename, title=None):
 		labels = [ t[0] for t in things ]
 		counts = [ t[1] for t in things ]
 
+	if use_svg(filename):
+		return svg().piechart(labels, counts, filename, get_colour,
+				title=title)
+
+	plt = pyplot()
 	colours = [ get_colour(l) for l in labels ]
 
 	wedges, texts = plt.pie(counts, colors=colours, startangle=90)
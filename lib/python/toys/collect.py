@@ -4,10 +4,13 @@ Data munging library to convert database-style records into categorized summarie
 
 import collections
 
+import toys.trace as trace
+
 def add_percent_labels(labels, values):
 	total = sum(values)
 	return [ '{} ({:1.1f}%)'.format(l, 100 * (v / total)) for l, v in zip(labels, values) ]
 
+@trace.traced('collect.accumulate')
 def accumulate(things, sieve, count=lambda t: 1):
 	'''Collate things into categories and count (or accumulate) them
 	'''
@@ -16,6 +19,7 @@ def accumulate(things, sieve, count=lambda t: 1):
 		results[sieve(t)] += count(t)
 	return results
 
+@trace.traced('collect.collate')
 def collate(things, sieve):
 	'''Collate things into categories
 	'''
@@ -47,6 +51,7 @@ def simplify(things, threshold=0.005):
 
 	return remaining
 
+@trace.traced('collect.accumulate_2d')
 def accumulate_2d(things, primary_sieve, secondary_sieve, count=lambda t: 1):
 	'''Collate the things in two different dimensions, then count them'''
 	data = collate(things, primary_sieve)
@@ -54,6 +59,46 @@ def accumulate_2d(things, primary_sieve, secondary_sieve, count=lambda t: 1):
 		data[k] = accumulate(data[k], secondary_sieve, count)
 	return data
 
+@trace.traced('collect.accumulate_tables')
+def accumulate_tables(things, wanted, periods, sieves, count=lambda t: 1,
+		      when=lambda t: t):
+	'''Build several tables of counts in a single pass over things.
+
+	wanted is a collection of (period, dimension) pairs. The table for
+	each pair is the same as accumulate_2d(things, period, dimension,
+	count) (or, if period is None, as accumulate(things, dimension,
+	count)) where period and dimension are looked up in periods and
+	sieves. The period functions are given when(thing) rather than the
+	thing itself so that, for example, a date need only be parsed once.
+
+	Every function is called at most once for each thing, no matter how
+	many tables are needed. Returns a dictionary of tables indexed by
+	(period, dimension).
+	'''
+	tables = {}
+	for (p, d) in wanted:
+		if p is None:
+			tables[(p, d)] = collections.defaultdict(int)
+		else:
+			tables[(p, d)] = collections.defaultdict(
+					lambda: collections.defaultdict(int))
+
+	used_periods = sorted(set(p for (p, d) in wanted if p is not None))
+	used_sieves = sorted(set(d for (p, d) in wanted))
+	for t in things:
+		n = count(t)
+		if used_periods:
+			w = when(t)
+			keys = { p: periods[p](w) for p in used_periods }
+		values = { d: sieves[d](t) for d in used_sieves }
+		for ((p, d), table) in tables.items():
+			if p is None:
+				table[values[d]] += n
+			else:
+				table[keys[p]][values[d]] += n
+
+	return tables
+
 def simplify_2d(things, threshold=0.03, category='Other', unconditional=()):
 	'''Merge small values into a special category.
 
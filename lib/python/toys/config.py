@@ -7,13 +7,16 @@ import getpass
 import os
 import sys
 
-# Import keyring, suppressing any warnings from gi when we do so
-try:
-	import gi
-	gi.require_version('GnomeKeyring', '1.0')
-except:
-	pass
-import keyring
+def get_keyring():
+	'''Import keyring (which is slow to import) on first use.'''
+	# Import keyring, suppressing any warnings from gi when we do so
+	try:
+		import gi
+		gi.require_version('GnomeKeyring', '1.0')
+	except:
+		pass
+	import keyring
+	return keyring
 
 def get_config():
 	'''Open (or create) a config file.'''
@@ -66,17 +69,46 @@ def get_config():
 
 def get_password(config, heading):
 	c = config[heading]
-	return keyring.get_password(c['server'], c['username'])
+	return get_keyring().get_password(c['server'], c['username'])
 
 def set_password(config, heading):
 	c = config[heading]
-	keyring.set_password(c['server'], c['username'], getpass.getpass())
+	get_keyring().set_password(c['server'], c['username'], getpass.getpass())
 
 def connect_to_jira():
 	'''Connect to the server using a password from the keyring.'''
 	cfg = get_config()['jira']
-	password = keyring.get_password(cfg['server'], cfg['username'])
+	password = get_keyring().get_password(cfg['server'], cfg['username'])
 
 	from jira.client import JIRA
-	return JIRA(options={'server': cfg['server']},
+	import toys.http
+	jira = JIRA(options={'server': cfg['server']},
 		    basic_auth=(cfg['username'], password))
+	toys.http.install(jira._session)
+	return jira
+
+def connect_to_discourse(timeout=5):
+	'''Connect to the 96Boards forum using an API key from the keyring.'''
+	cfg = get_config()
+	password = get_password(cfg, '96btool')
+	cfg = cfg['96btool']
+
+	import pydiscourse
+	import pydiscourse.client
+	import toys.http
+	toys.http.patch_module(pydiscourse.client)
+	return pydiscourse.DiscourseClient(cfg['server'],
+			api_username=cfg['username'], api_key=password,
+			timeout=timeout)
+
+def connect_to_zendesk():
+	'''Connect to zendesk using an API token from the keyring.'''
+	cfg = get_config()
+	password = get_password(cfg, 'zendesk')
+	cfg = cfg['zendesk']
+
+	import zdesk
+	import toys.http
+	zd = zdesk.Zendesk(cfg['server'], cfg['username'], password)
+	toys.http.install(zd.client)
+	return zd
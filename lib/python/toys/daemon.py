@@ -0,0 +1,145 @@
+'''
+Client side of toysd (and the wire protocol it shares with it).
+
+toysd keeps the databases used by glance, ldtstool and 96btool loaded in
+memory and runs read-only sub-commands on behalf of the tools. A tool
+asks the daemon to do its work by calling forward() as soon as it has
+parsed its arguments. If the daemon is not running (or the sub-command
+cannot be forwarded) forward() returns None and the tool carries on by
+itself, so using the daemon is entirely transparent.
+
+Messages are a single line of JSON (the header) followed by a binary
+payload whose length is given in the header.
+
+The daemon's socket must be owned by (and private to) the user running
+the tool, otherwise the tool ignores it and does the work itself. The
+tool's TOYS_* settings (and TZ) are sent with each request so the daemon
+runs the sub-command the same way the tool would have done.
+
+Set TOYSD=0 in the environment to stop the tools using the daemon.
+'''
+
+import io
+import json
+import os
+import socket
+import stat
+import sys
+
+# Set by toysd itself (to stop it forwarding requests back to itself)
+serving = False
+
+# When serving, the arguments of the request that is being run (this
+# allows toysd to use its indexes to answer filter requests)
+current = None
+
+def socket_path():
+	if 'TOYSD_SOCKET' in os.environ:
+		return os.environ['TOYSD_SOCKET']
+	if 'XDG_RUNTIME_DIR' in os.environ:
+		return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'toysd.sock')
+	return '/tmp/toysd-{}/toysd.sock'.format(os.getuid())
+
+def make_socket_dir(path):
+	'''Create the directory for the socket (if needed) so only we can use it.'''
+	d = os.path.dirname(path)
+	if d and not os.path.isdir(d):
+		os.makedirs(d, 0o700)
+
+def trusted(path):
+	'''Check path is a socket that belongs to us and nobody else.
+
+	Anyone can create a file in /tmp so the daemon we find there could
+	belong to another user (who would then see our requests and choose
+	our output).
+	'''
+	try:
+		st = os.lstat(path)
+	except OSError:
+		return False
+	return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid() and \
+	       not st.st_mode & 0o077
+
+def environment():
+	'''Find the parts of the environment that affect the sub-commands.'''
+	return dict((k, v) for (k, v) in os.environ.items()
+			if k.startswith('TOYS_') or k == 'TZ')
+
+def send_message(sock, header, payload=b''):
+	header = dict(header, length=len(payload))
+	sock.sendall(json.dumps(header).encode('UTF-8') + b'\n' + payload)
+
+def recv_message(f):
+	'''Read a message from a file-like wrapper around a socket.'''
+	ln = f.readline()
+	if not ln:
+		raise EOFError('connection closed')
+	header = json.loads(ln.decode('UTF-8'))
+	payload = f.read(header['length'])
+	if len(payload) != header['length']:
+		raise EOFError('truncated message')
+	return (header, payload)
+
+def request(header, payload=b'', path=None):
+	'''Send a request to the daemon and wait for the reply.'''
+	path = path if path else socket_path()
+	if not trusted(path):
+		raise PermissionError('{} is not a private socket'.format(path))
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(path)
+		send_message(sock, header, payload)
+		with sock.makefile('rb') as f:
+			return recv_message(f)
+	finally:
+		sock.close()
+
+def forward(tool, argv, args, commands):
+	'''Run a sub-command using the daemon (if it is running).
+
+	Returns the exit status of the sub-command or None if the caller
+	must run the sub-command itself.
+	'''
+	global current
+	if serving:
+		current = args
+		return None
+
+	if getattr(args, 'sub-command') not in commands or \
+	   os.environ.get('TOYSD') == '0' or \
+	   getattr(args, 'profile', None) or getattr(args, 'cprofile', None):
+		return None
+
+	path = socket_path()
+	if not trusted(path):
+		return None
+
+	# Data provided on stdin must be passed to the daemon. We can't do
+	# that for an interactive terminal (and it is unlikely the user
+	# wants us to).
+	stdin = b''
+	if getattr(args, 'json', '') is None:
+		if sys.stdin.isatty():
+			return None
+		stdin = sys.stdin.buffer.read()
+
+	try:
+		(header, payload) = request({ 'op': 'run', 'tool': tool,
+			'argv': argv, 'cwd': os.getcwd(),
+			'environ': environment() }, stdin, path)
+	except (OSError, EOFError, ValueError):
+		header = { 'status': None }
+
+	if header['status'] is None:
+		# Put back anything we read so we can run the sub-command
+		# ourselves
+		sys.stdin = io.TextIOWrapper(io.BytesIO(stdin))
+		return None
+
+	sys.stdout.flush()
+	sys.stdout.buffer.write(payload[:header['stdout']])
+	sys.stdout.flush()
+	sys.stderr.buffer.write(payload[header['stdout']:])
+	sys.stderr.flush()
+	return header['status']
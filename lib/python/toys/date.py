@@ -6,6 +6,8 @@ import datetime
 import iso8601
 import subprocess
 
+import toys.trace as trace
+
 def smart_parse(s, end_of_day=False):
 	'''Convert a string to a datetime object.
 
@@ -13,8 +15,10 @@ def smart_parse(s, end_of_day=False):
 	parser).
 
 	'''
+	trace.count('date.subprocesses')
 	try:
-		date = subprocess.check_output(["date", "-d", s, "+%Y-%m-%d %H:%M:%S"])
+		with trace.span('smart_parse', s=s):
+			date = subprocess.check_output(["date", "-d", s, "+%Y-%m-%d %H:%M:%S"])
 	except subprocess.CalledProcessError as e:
 		'''
 		OS X date command does not support some of the GNU extensions
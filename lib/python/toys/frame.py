@@ -0,0 +1,144 @@
+'''
+Columnar (Parquet) copies of the tools' data for analysis with pandas.
+
+The tools store nested JSON which has to be flattened every time it is
+loaded into a data frame. export() writes a flattened, typed copy of a
+set of records instead. Each table is a directory containing one Parquet
+file per month (using hive style month=YYYY-MM directories) together with
+a manifest (_manifest.json) holding a digest of the rows in each month.
+Exporting again only rewrites the months whose rows have changed.
+
+Reading a table back memory maps the files and decodes only the columns
+(and months) that are asked for:
+
+    import toys.frame as frame
+    df = frame.frame('export/', 'worklogs', columns=['author', 'hours'],
+                     since=datetime.datetime(2018, 1, 1))
+
+pyarrow (and pandas, for frame()) are only needed by this module and are
+imported when first used.
+'''
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+
+# Column types (these are the only ones export() knows how to write)
+column_types = ( 'bool', 'float64', 'int64', 'string', 'strings',
+		 'timestamp' )
+
+def arrow():
+	'''Import pyarrow (this is slow so is only done when needed).'''
+	import pyarrow
+	import pyarrow.parquet
+	return pyarrow
+
+def arrow_type(pa, t):
+	return {
+		'bool': pa.bool_(),
+		'float64': pa.float64(),
+		'int64': pa.int64(),
+		'string': pa.string(),
+		'strings': pa.list_(pa.string()),
+		'timestamp': pa.timestamp('us', tz='UTC'),
+	}[t]
+
+def month(d):
+	return '{:04d}-{:02d}'.format(d.year, d.month) if d else 'none'
+
+def digest(columns, rows):
+	h = hashlib.sha1(repr([ (name, t) for (name, t, fn) in columns ]).encode())
+	for row in rows:
+		h.update(repr(row).encode())
+	return h.hexdigest()
+
+def load_manifest(tabledir):
+	try:
+		with open(os.path.join(tabledir, '_manifest.json')) as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return {}
+
+def save_manifest(tabledir, manifest):
+	fname = os.path.join(tabledir, '_manifest.json')
+	with open(fname + '.tmp', 'w') as f:
+		json.dump(manifest, f, sort_keys=True, indent=2)
+	os.replace(fname + '.tmp', fname)
+
+def export(dirname, name, records, columns, when):
+	'''Write records to a month partitioned table.
+
+	columns is a list of (name, type, fn) tuples, where fn extracts the
+	value of the column from a record, and when(record) returns the
+	datetime used to choose the month. Returns the number of months
+	that were (re)written.
+	'''
+	for (column, t, fn) in columns:
+		assert t in column_types, t
+
+	months = collections.defaultdict(list)
+	for r in records:
+		months[month(when(r))].append(tuple(fn(r) for (c, t, fn) in columns))
+
+	tabledir = os.path.join(dirname, name)
+	os.makedirs(tabledir, exist_ok=True)
+	manifest = load_manifest(tabledir)
+	written = 0
+
+	for (m, rows) in sorted(months.items()):
+		partdir = os.path.join(tabledir, 'month=' + m)
+		fname = os.path.join(partdir, 'part-0.parquet')
+		d = digest(columns, rows)
+		if manifest.get(m) == d and os.path.exists(fname):
+			continue
+
+		pa = arrow()
+		arrays = [ pa.array(list(values), type=arrow_type(pa, t))
+			   for (values, (c, t, fn)) in zip(zip(*rows), columns) ]
+		table = pa.Table.from_arrays(arrays,
+				names=[ c for (c, t, fn) in columns ])
+
+		# Files starting with a dot are ignored by readers so the
+		# partition is never seen half written
+		os.makedirs(partdir, exist_ok=True)
+		tmp = os.path.join(partdir, '.part-0.parquet.tmp')
+		pa.parquet.write_table(table, tmp)
+		os.replace(tmp, fname)
+		manifest[m] = d
+		written += 1
+
+	# Months that no longer have any records
+	for m in set(manifest) - set(months):
+		shutil.rmtree(os.path.join(tabledir, 'month=' + m),
+				ignore_errors=True)
+		del manifest[m]
+		written += 1
+
+	save_manifest(tabledir, manifest)
+	return written
+
+def table(dirname, name, columns=None, since=None, until=None):
+	'''Memory map a table, reading only the columns (and months) needed.
+
+	since and until are datetimes and select whole months. Records
+	without a date (month=none) are only included if neither is given.
+	Returns a pyarrow Table.
+	'''
+	pa = arrow()
+	filters = []
+	if since:
+		filters.append(('month', '>=', month(since)))
+	if until:
+		filters.append(('month', '<=', month(until)))
+	if filters:
+		# 'none' sorts after every month so must be excluded explicitly
+		filters.append(('month', '!=', month(None)))
+	return pa.parquet.read_table(os.path.join(dirname, name),
+			columns=columns, filters=filters if filters else None,
+			memory_map=True, partitioning='hive')
+
+def frame(dirname, name, columns=None, since=None, until=None):
+	'''Load a table as a pandas DataFrame.'''
+	return table(dirname, name, columns, since, until).to_pandas()
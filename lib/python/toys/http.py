@@ -0,0 +1,382 @@
+'''
+Shared HTTP plumbing for the tools that fetch data from web services.
+
+All the web service clients we use (jira, zdesk and pydiscourse) are
+built on top of requests. This module provides a single, process-wide
+requests session (giving keep-alive connection pooling and gzip
+transfers) together with a transport adapter that keeps an on-disk
+cache of GET responses. Cached responses are revalidated using
+ETag/Last-Modified so a repeat fetch normally costs a 304 (or, if
+max_age is set, nothing at all).
+
+The cache is private to the user (and keyed by the credentials used) so
+responses are cached even if the server asks for them not to be stored.
+Entries that have not been used for cache_max_age seconds are removed,
+as are the least recently used entries once the cache grows beyond
+cache_max_size bytes, whenever prune() is called (the pull commands do
+this each time they run).
+
+Setting TOYS_HTTP_RATE to a number of requests per second limits how
+quickly the process sends requests (this is how sync keeps each service
+within its own limit while they are all being fetched at once).
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+
+import toys.trace as trace
+
+# Limits applied by prune()
+cache_max_age = 90 * 24 * 60 * 60
+cache_max_size = 256 * 1024 * 1024
+
+def build_response(request, status, reason, headers, body, adapter=None):
+	'''Construct a response without contacting the server.'''
+	response = requests.Response()
+	response.status_code = status
+	response.reason = reason
+	response.headers = requests.structures.CaseInsensitiveDict(headers)
+	response.encoding = requests.utils.get_encoding_from_headers(
+			response.headers)
+	response._content = body
+	response.url = request.url
+	response.request = request
+	response.connection = adapter
+	return response
+
+def get_cache_dir():
+	'''Find (but do not create) the directory used to cache responses.'''
+	if 'TOYS_HTTP_CACHE' in os.environ:
+		return os.environ['TOYS_HTTP_CACHE']
+
+	cache = os.environ.get('XDG_CACHE_HOME',
+			os.path.join(os.environ['HOME'], '.cache'))
+	return os.path.join(cache, 'linaro_toys', 'http')
+
+class CachingAdapter(requests.adapters.HTTPAdapter):
+	'''Transport adapter that caches GET responses on disk.
+
+	Responses are only cached if they can be revalidated (i.e. the
+	server provided an ETag or Last-Modified header). If max_age is
+	non-zero then cached responses younger than max_age seconds are
+	used without contacting the server at all.
+	'''
+	# Headers that identify who is making the request (these form part
+	# of the cache key so different users never share an entry)
+	identity_headers = ( 'Authorization', 'Api-Key', 'Api-Username' )
+
+	# Headers that servers commonly Vary on (these are also part of the
+	# cache key so we never return a representation that wasn't asked for)
+	vary_headers = ( 'Accept', 'Accept-Language' )
+
+	# The body is stored already decoded
+	dropped_headers = ( 'Content-Encoding', 'Content-Length',
+			    'Transfer-Encoding' )
+
+	def __init__(self, cache_dir=None, max_age=0, **kwargs):
+		super(CachingAdapter, self).__init__(**kwargs)
+		self.cache_dir = cache_dir if cache_dir else get_cache_dir()
+		self.max_age = max_age
+		self.private = False
+
+	def _key(self, request):
+		h = hashlib.sha256()
+		h.update(request.method.encode('UTF-8'))
+		h.update(request.url.encode('UTF-8'))
+		for k in self.identity_headers + self.vary_headers:
+			h.update('\0{}'.format(request.headers.get(k, '')).encode('UTF-8'))
+		return h.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.cache_dir, key[:2], key)
+
+	def _load(self, key):
+		path = self._path(key)
+		try:
+			with open(path + '.json', 'r') as f:
+				entry = json.load(f)
+			with open(path + '.body', 'rb') as f:
+				entry['body'] = f.read()
+		except (IOError, OSError, ValueError):
+			return None
+		return entry
+
+	def _write(self, fname, data, mode='w'):
+		# Write then rename so that concurrent readers never see a
+		# partial entry
+		tmp = '{}.{}.tmp'.format(fname, os.getpid())
+		fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		with os.fdopen(fd, mode) as f:
+			if mode == 'w':
+				json.dump(data, f)
+			else:
+				f.write(data)
+		os.rename(tmp, fname)
+
+	def _store(self, key, entry, body=None):
+		path = self._path(key)
+		if not self.private:
+			# The cache holds authenticated responses so keep it to
+			# ourselves (even if an older version created it)
+			try:
+				os.makedirs(self.cache_dir, 0o700)
+			except OSError:
+				pass
+			os.chmod(self.cache_dir, 0o700)
+			self.private = True
+		try:
+			os.makedirs(os.path.dirname(path), 0o700)
+		except OSError:
+			pass
+
+		entry = dict((k, v) for k, v in entry.items() if k != 'body')
+		if body is not None:
+			self._write(path + '.body', body, 'wb')
+		self._write(path + '.json', entry)
+
+	def _build(self, request, entry, revalidation=None):
+		'''Construct a response from a cache entry.'''
+		response = build_response(request, entry['status'],
+				entry['reason'], entry['headers'], entry['body'],
+				self)
+		if revalidation is not None:
+			response.elapsed = revalidation.elapsed
+			response.history = revalidation.history
+
+		# Allow callers (and tests) to see where the data came from
+		response.from_cache = True
+		return response
+
+	def send(self, request, **kwargs):
+		if request.method != 'GET':
+			return super(CachingAdapter, self).send(request, **kwargs)
+
+		key = self._key(request)
+		entry = self._load(key)
+		if entry:
+			if self.max_age and time.time() - entry['stored'] < self.max_age:
+				return self._build(request, entry)
+
+			if entry['etag']:
+				request.headers['If-None-Match'] = entry['etag']
+			if entry['last_modified']:
+				request.headers['If-Modified-Since'] = entry['last_modified']
+
+		response = super(CachingAdapter, self).send(request, **kwargs)
+		response.from_cache = False
+
+		if response.status_code == 304 and entry:
+			# Drain the (empty) body so the connection returns to
+			# the pool
+			response.content
+			entry['stored'] = time.time()
+			self._store(key, entry)
+			return self._build(request, entry, response)
+
+		etag = response.headers.get('ETag')
+		last_modified = response.headers.get('Last-Modified')
+		if response.status_code == 200 and (etag or last_modified):
+			headers = dict((k, v) for k, v in response.headers.items()
+					if k not in self.dropped_headers)
+			entry = {
+				'url': request.url,
+				'status': response.status_code,
+				'reason': response.reason,
+				'headers': headers,
+				'etag': etag,
+				'last_modified': last_modified,
+				'stored': time.time(),
+			}
+			self._store(key, entry, response.content)
+
+		return response
+
+def prune(cache_dir=None, max_age=None, max_size=None):
+	'''Remove stale entries from the on-disk cache.
+
+	Entries not used for max_age seconds are removed, followed by the
+	least recently used entries until the cache is no larger than
+	max_size bytes. Returns the number of entries removed.
+	'''
+	cache_dir = cache_dir if cache_dir else get_cache_dir()
+	max_age = cache_max_age if max_age is None else max_age
+	max_size = cache_max_size if max_size is None else max_size
+
+	# Every file belonging to an entry (including any temporary files
+	# from an interrupted write) starts with the key
+	entries = {}
+	try:
+		subdirs = os.listdir(cache_dir)
+	except OSError:
+		return 0
+	for subdir in subdirs:
+		subdir = os.path.join(cache_dir, subdir)
+		try:
+			fnames = os.listdir(subdir)
+		except OSError:
+			continue
+		for fname in fnames:
+			fname = os.path.join(subdir, fname)
+			try:
+				st = os.stat(fname)
+			except OSError:
+				continue
+			key = os.path.basename(fname).split('.')[0]
+			(files, size, used) = entries.get(key, ([], 0, 0))
+			entries[key] = (files + [fname], size + st.st_size,
+					max(used, st.st_mtime))
+
+	# Oldest first (an entry is rewritten every time it is revalidated)
+	entries = sorted(entries.values(), key=lambda e: e[2])
+	total = sum(e[1] for e in entries)
+	now = time.time()
+	removed = 0
+	for (files, size, used) in entries:
+		if now - used < max_age and total <= max_size:
+			break
+		for fname in files:
+			try:
+				os.remove(fname)
+			except OSError:
+				pass
+		total -= size
+		removed += 1
+
+	if removed:
+		trace.count('http.pruned', removed)
+	return removed
+
+def trace_response(response, *args, **kwargs):
+	'''Response hook to count (and time) requests when tracing.'''
+	if not trace.enabled():
+		return
+
+	trace.count('http.requests')
+	if getattr(response, 'from_cache', False):
+		trace.count('http.cache_hits')
+
+	# Reading the body of a streamed response would spoil it for the
+	# caller so we rely on the server's description of the length
+	if kwargs.get('stream'):
+		length = int(response.headers.get('Content-Length', 0))
+	else:
+		length = len(response.content)
+	trace.count('http.bytes', length)
+
+	retries = getattr(response.raw, 'retries', None)
+	if retries and retries.history:
+		trace.count('http.retries', len(retries.history))
+
+	elapsed = response.elapsed.total_seconds()
+	trace.complete('{} {}'.format(response.request.method,
+				response.request.path_url.split('?')[0]),
+			time.perf_counter() - elapsed, elapsed, cat='http',
+			status=response.status_code)
+
+class RateLimit(object):
+	'''Space requests so no more than rate are sent each second.'''
+	def __init__(self, rate):
+		self.interval = 1.0 / rate
+		self.lock = threading.Lock()
+		self.next = 0
+
+	@staticmethod
+	def from_environ():
+		rate = float(os.environ.get('TOYS_HTTP_RATE', 0))
+		return RateLimit(rate) if rate > 0 else None
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.next - now
+			self.next = max(now, self.next) + self.interval
+		if delay > 0:
+			trace.count('http.throttled')
+			time.sleep(delay)
+
+	def wrap(self, adapter):
+		'''Make adapter wait for the rate limit before each request.'''
+		if getattr(adapter, 'rate_limit', None):
+			return
+		send = adapter.send
+		def throttled_send(request, **kwargs):
+			self.wait()
+			return send(request, **kwargs)
+		adapter.send = throttled_send
+		adapter.rate_limit = self
+
+_rate_limit = None
+_session = None
+
+def install(session, cache=True, max_age=0, pool_maxsize=10):
+	'''Mount the caching adapter onto an existing requests session.
+
+	This is used to retrofit the cache onto sessions created by the
+	web service client libraries.
+
+	If TOYS_HTTP_RECORD or TOYS_HTTP_REPLAY are set in the environment
+	then a cassette adapter (see toys.cassette) is mounted instead.
+	'''
+	global _rate_limit
+	if 'TOYS_HTTP_REPLAY' in os.environ:
+		import toys.cassette
+		adapter = toys.cassette.ReplayAdapter.from_environ()
+	elif 'TOYS_HTTP_RECORD' in os.environ:
+		import toys.cassette
+		adapter = toys.cassette.RecordingAdapter.from_environ(
+				pool_maxsize=pool_maxsize)
+	elif cache:
+		adapter = CachingAdapter(max_age=max_age,
+				pool_maxsize=pool_maxsize)
+	else:
+		adapter = requests.adapters.HTTPAdapter(
+				pool_maxsize=pool_maxsize)
+
+	# Every session in the process shares the same limit
+	if _rate_limit is None:
+		_rate_limit = RateLimit.from_environ() or False
+	if _rate_limit:
+		_rate_limit.wrap(adapter)
+
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	if trace_response not in session.hooks['response']:
+		session.hooks['response'].append(trace_response)
+	return session
+
+def session():
+	'''Get the process-wide session (creating it if required).'''
+	global _session
+	if not _session:
+		_session = install(requests.Session())
+	return _session
+
+class _RequestsShim(object):
+	'''Stand-in for the requests module that routes requests through the
+	shared session.'''
+	def __getattr__(self, name):
+		return getattr(requests, name)
+
+	def request(self, method, url, **kwargs):
+		return session().request(method, url, **kwargs)
+
+	def get(self, url, **kwargs):
+		return session().get(url, **kwargs)
+
+def patch_module(module):
+	'''Make a module that calls requests.request() directly use the
+	shared session instead.
+
+	Some client libraries (such as pydiscourse) issue every request via
+	the module level helpers, making a new connection each time, and
+	provide no way to supply a session.
+	'''
+	module.requests = _RequestsShim()
@@ -0,0 +1,167 @@
+'''
+Offset index for random access into the JSON databases by key.
+
+The databases are ordinary JSON documents but they are written with one
+record per line and, as they are written, the byte offset and length of
+every record is noted. The offsets are stored beside the database (in a
+dbm file called <database>.offsets) so a single record can be found and
+decoded without parsing the rest of the file:
+
+    with offsets.Writer(fname) as w:
+        w.raw('{"posts":')
+        w.records(posts, key=lambda p: p['id'], prefix='post/')
+        w.raw('}')
+
+    if offsets.OffsetIndex.current(fname):
+        with offsets.OffsetIndex(fname) as index:
+            post = index.get('post/1234')
+
+The index records the size and modification time of the database that it
+describes. If the database is changed by some other means the index is
+no longer current and callers should fall back to loading everything.
+'''
+
+import dbm
+import json
+import mmap
+import os
+import struct
+
+# The stamp of the database is stored alongside the offsets (a key can
+# never start with a NUL so this cannot clash)
+STAMP = b'\0stamp'
+
+location = struct.Struct('<QQ')
+
+def stamp(fname):
+	st = os.stat(fname)
+	return '{} {}'.format(st.st_size, st.st_mtime_ns).encode()
+
+def encode(obj):
+	'''Encode a record as a single line of JSON.'''
+	return json.dumps(obj, sort_keys=True, ensure_ascii=False).encode('UTF-8')
+
+class Writer(object):
+	'''Write a database (and its offset index) one record per line.'''
+	def __init__(self, fname):
+		self.fname = fname
+		self.f = open(fname, 'wb')
+		self.offset = 0
+		self.offsets = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, *args):
+		self.f.close()
+		if exc_type is None:
+			self.save()
+
+	def raw(self, s):
+		'''Write some JSON syntax (that is not part of a record).'''
+		s = s.encode('UTF-8')
+		self.f.write(s)
+		self.offset += len(s)
+
+	def record(self, key, obj):
+		data = encode(obj)
+		if key is not None:
+			self.offsets[key] = (self.offset, len(data))
+		self.f.write(data)
+		self.offset += len(data)
+
+	def records(self, records, key=None, prefix=''):
+		'''Write a list of records (indexed using key, if given).'''
+		self.raw('[')
+		for n, r in enumerate(records):
+			self.raw(',\n' if n else '\n')
+			self.record(prefix + str(key(r)) if key else None, r)
+		self.raw('\n]')
+
+	def mapping(self, d, prefix=''):
+		'''Write a dict of records (indexed using their keys).'''
+		self.raw('{')
+		for n, k in enumerate(sorted(d)):
+			self.raw(',\n' if n else '\n')
+			self.raw(json.dumps(str(k)) + ':')
+			self.record(prefix + str(k), d[k])
+		self.raw('\n}')
+
+	def save(self):
+		OffsetIndex.remove(self.fname)
+		db = dbm.open(self.fname + '.offsets', 'n')
+		try:
+			for k, v in self.offsets.items():
+				db[k.encode('UTF-8')] = location.pack(*v)
+			# Written last so a half written index is never current
+			db[STAMP] = stamp(self.fname)
+		finally:
+			db.close()
+
+class OffsetIndex(object):
+	'''Read single records from a database using its offset index.'''
+	def __init__(self, fname):
+		self.fname = fname
+		self.db = dbm.open(fname + '.offsets', 'r')
+		self.f = open(fname, 'rb')
+		if os.fstat(self.f.fileno()).st_size:
+			self.map = mmap.mmap(self.f.fileno(), 0,
+					access=mmap.ACCESS_READ)
+		else:
+			self.map = b''
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if self.map:
+			self.map.close()
+		self.f.close()
+		self.db.close()
+
+	@staticmethod
+	def exists(fname):
+		return dbm.whichdb(fname + '.offsets') not in (None, '')
+
+	@staticmethod
+	def current(fname):
+		'''Check the index exists and still matches the database.'''
+		if not OffsetIndex.exists(fname):
+			return False
+		try:
+			db = dbm.open(fname + '.offsets', 'r')
+			try:
+				return db.get(STAMP) == stamp(fname)
+			finally:
+				db.close()
+		except OSError:
+			return False
+
+	@staticmethod
+	def remove(fname):
+		'''Delete an index (dbm may have spread it over several files)'''
+		fname += '.offsets'
+		for ext in ('', '.db', '.dat', '.dir', '.bak', '.pag'):
+			if os.path.exists(fname + ext):
+				os.remove(fname + ext)
+
+	def __contains__(self, key):
+		return key.encode('UTF-8') in self.db
+
+	def locate(self, key):
+		'''Return the (offset, length) of a record.'''
+		return location.unpack(self.db[key.encode('UTF-8')])
+
+	def raw(self, key):
+		(offset, length) = self.locate(key)
+		return self.map[offset:offset+length]
+
+	def get(self, key, default=None):
+		'''Decode a single record (or return default if there isn't one).'''
+		try:
+			return json.loads(self.raw(key).decode('UTF-8'))
+		except KeyError:
+			return default
@@ -0,0 +1,301 @@
+'''
+Compact, read-mostly records for large datasets.
+
+The tools model their records as dict subclasses that wrap the raw API
+payload. That is simple and lets them write records straight back out
+but it keeps every one of the (many) fields the servers send us in
+memory, each as a separate python object.
+
+A compact record keeps only the values its schema lists, stored in
+slots. Strings are interned and sub-objects that repeat from record to
+record (such as users, organizations and issue types) are shared rather
+than copied. Everything else (the remainder) stays in the record as
+encoded JSON and is only decoded if someone asks for a value the schema
+did not keep.
+
+Compact records behave enough like the dict records for the tools to use
+them unchanged. compact() makes the compact type for a dict record class
+(borrowing its methods):
+
+    CompactTicket = record.compact(Ticket, {
+        'id': None,                 # keep the value
+        'tags': None,
+        'assignee': record.SHARED,  # keep it, shared with other records
+        'organization': record.SHARED,
+    })
+
+    data = json.load(f)
+    if record.worthwhile(data):
+        tickets = record.load(CompactTicket, data)
+
+A schema can also describe a sub-object (or list of sub-objects) using a
+nested schema. These are pruned in the same way as the record itself.
+'''
+
+import copy
+import json
+import os
+import sys
+
+# Schema value for sub-objects that are deduplicated (but not pruned)
+SHARED = 'shared'
+
+_missing = object()
+
+# Compacting records takes a while (longer than decoding the JSON did) so
+# only datasets with at least this many records are compacted
+threshold = int(os.environ.get('TOYS_COMPACT_THRESHOLD', 20000))
+
+# Strings longer than this are unlikely to repeat so are not interned
+intern_limit = 80
+
+def encode(d):
+	return json.dumps(d, separators=(',', ':'),
+			ensure_ascii=False).encode('UTF-8')
+
+def merge(value, rest):
+	'''Put back together a value and its remainder (as plain JSON).'''
+	if isinstance(value, Pruned):
+		d = {}
+		for k in value._keys:
+			if dict.__contains__(value, k):
+				d[k] = merge(dict.__getitem__(value, k),
+					     rest.get(k) if rest else None)
+			else:
+				d[k] = rest[k]
+		return d
+	if isinstance(value, list):
+		return [ merge(v, rest[i] if rest else None)
+				for i, v in enumerate(value) ]
+	return value
+
+def fingerprint(value):
+	'''A hashable value that is equal for equal sub-objects.'''
+	if isinstance(value, dict):
+		key = tuple(value.items())
+	else:
+		key = tuple(tuple(v.items()) if isinstance(v, dict) else v
+				for v in value)
+	try:
+		hash(key)
+		return key
+	except TypeError:
+		# Deeply nested (this is slower but handles anything)
+		return json.dumps(value, sort_keys=True)
+
+def lookup(raw, path):
+	'''Decode the remainder and find the value at path.'''
+	value = json.loads(raw.decode('UTF-8'))
+	for p in path:
+		value = value[p]
+	return value
+
+class Pruned(dict):
+	'''A sub-object that has lost some of its values.
+
+	Missing values are decoded from the record's remainder on demand.
+	'''
+	__slots__ = ('_raw', '_path', '_keys')
+
+	def __missing__(self, key):
+		if key not in self._keys:
+			raise KeyError(key)
+		return lookup(self._raw, self._path + (key,))
+
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or key in self._keys
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+class Compactor(object):
+	'''Holds the shared values used while compacting a set of records.'''
+	def __init__(self):
+		self.shared = {}
+		self.by_id = {}
+		self.key_sets = {}
+		self.pending = []
+
+	def keep(self, value):
+		if isinstance(value, str):
+			return sys.intern(value) if len(value) <= intern_limit else value
+		if isinstance(value, list):
+			return [ self.keep(v) for v in value ]
+		return value
+
+	def share(self, value):
+		if not isinstance(value, (dict, list)):
+			return self.keep(value)
+
+		# Records that already share a sub-object (such as the topics
+		# of 96btool posts) are recognised without encoding it again.
+		# The original is kept alive so its id cannot be reused.
+		if id(value) in self.by_id:
+			return self.by_id[id(value)][1]
+		canonical = self.shared.setdefault(fingerprint(value), value)
+		self.by_id[id(value)] = (value, canonical)
+		return canonical
+
+	def keys(self, d):
+		'''The keys of d (as a tuple shared with records of the same shape).'''
+		keys = tuple(d)
+		return self.key_sets.setdefault(keys, keys)
+
+	def split(self, d, schema, path):
+		'''Divide d into a pruned sub-object and its remainder.'''
+		p = Pruned()
+		p._path = path
+		p._keys = self.keys(d)
+		rest = {}
+		for k, v in d.items():
+			spec = schema.get(k, _missing)
+			if spec is _missing:
+				rest[k] = v
+				continue
+			(value, r) = self.convert(v, spec, path + (k,))
+			p[k] = value
+			if r:
+				rest[k] = r
+		self.pending.append(p)
+		return (p, rest)
+
+	def convert(self, value, spec, path):
+		'''Return the part of value to keep and its remainder (if any).'''
+		if spec is None:
+			return (self.keep(value), None)
+		if spec == SHARED:
+			return (self.share(value), None)
+		if isinstance(spec, dict) and isinstance(value, dict):
+			return self.split(value, spec, path)
+		if isinstance(spec, list) and isinstance(value, list):
+			kept = []
+			rest = []
+			for i, v in enumerate(value):
+				(k, r) = self.convert(v, spec[0], path + (i,))
+				kept.append(k)
+				rest.append(r)
+			return (kept, rest if any(rest) else None)
+		return (self.keep(value), None)
+
+	def finish(self, rest):
+		'''Encode the remainder of a record (and tell its sub-objects).'''
+		raw = encode(rest)
+		for p in self.pending:
+			p._raw = raw
+		self.pending = []
+		return raw
+
+class Record(object):
+	'''Base class for the types made by compact().'''
+	__slots__ = ('_raw', '_keys', '_extra')
+	_schema = {}
+	_slots = {}
+
+	def __init__(self, d, compactor=None):
+		if not compactor:
+			compactor = Compactor()
+		self._keys = compactor.keys(d)
+		self._extra = None
+		rest = {}
+		for k, v in d.items():
+			spec = self._schema.get(k, _missing)
+			if spec is _missing:
+				rest[k] = v
+				continue
+			(value, r) = compactor.convert(v, spec, (k,))
+			setattr(self, self._slots[k], value)
+			if r:
+				rest[k] = r
+		self._raw = compactor.finish(rest)
+
+	def __getitem__(self, key):
+		if self._extra and key in self._extra:
+			return self._extra[key]
+		slot = self._slots.get(key)
+		if slot:
+			value = getattr(self, slot, _missing)
+			if value is not _missing:
+				return value
+		elif key in self._keys:
+			return lookup(self._raw, (key,))
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key in self._slots:
+			setattr(self, self._slots[key], value)
+		else:
+			if self._extra is None:
+				self._extra = {}
+			self._extra[key] = value
+
+	def __contains__(self, key):
+		if key in self._slots:
+			return hasattr(self, self._slots[key]) or \
+			       bool(self._extra and key in self._extra)
+		return key in self._keys or bool(self._extra and key in self._extra)
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		keys = [ k for k in self._keys if k in self ]
+		keys += [ k for k in (self._extra or ()) if k not in self._keys ]
+		return keys
+
+	def items(self):
+		return [ (k, self[k]) for k in self.keys() ]
+
+	def values(self):
+		return [ self[k] for k in self.keys() ]
+
+	def decode(self):
+		'''Rebuild the full record as a (new) dict.'''
+		rest = json.loads(self._raw.decode('UTF-8'))
+		d = {}
+		for k in self.keys():
+			if self._extra and k in self._extra:
+				d[k] = self._extra[k]
+			elif k in self._slots:
+				d[k] = merge(self[k], rest.get(k))
+			else:
+				d[k] = rest[k]
+		return copy.deepcopy(d)
+
+def compact(base, schema, name=None):
+	'''Make a compact record type from a dict record class.
+
+	The new type has a slot for every top-level key in schema and
+	borrows the methods (and class attributes) of base, which must only
+	use the dict interface to access the record.
+	'''
+	for k in schema:
+		assert k.isidentifier(), k
+	namespace = { k: v for k, v in vars(base).items()
+			if k not in ('__dict__', '__weakref__', '__module__',
+				     '__doc__', '__qualname__') }
+	slots = { k: '_v_' + k for k in schema }
+	namespace.update(__slots__=tuple(slots.values()),
+			 _schema=schema, _slots=slots)
+	return type(name if name else 'Compact' + base.__name__, (Record,),
+			namespace)
+
+def worthwhile(data):
+	'''Check whether a dataset is large enough to be worth compacting.'''
+	return len(data) >= threshold
+
+def load(cls, data):
+	'''Compact a list of decoded records (sharing values between them).'''
+	compactor = Compactor()
+	return [ cls(d, compactor) for d in data ]
@@ -0,0 +1,176 @@
+'''
+Materialized date x dimension totals (a rollup cube) for a database.
+
+A rollup records, for each dimension, the total for every (day, value)
+pair. Tables of month (or week) by value can be sliced out of it without
+having to load and sieve every record, so sub-commands that only need
+totals can answer in time proportional to the size of the cube rather
+than the size of the database.
+
+The contribution made by each record is kept (in a separate file so
+queries need not read it) allowing records to be added or replaced
+incrementally without double counting.
+'''
+
+import collections
+import datetime
+import json
+import os
+
+def utc(d):
+	'''Convert a (timezone aware) datetime to UTC.'''
+	if d.tzinfo is None:
+		return d
+	return d.astimezone(datetime.timezone.utc)
+
+def by_month(day):
+	return day[:7]
+
+def by_week(day):
+	'''Label a day using the Friday that ends its week.'''
+	d = datetime.datetime.strptime(day, '%Y-%m-%d')
+	d += datetime.timedelta((4 - d.weekday()) % 7)
+	return d.strftime('%Y-%m-%d')
+
+class Rollup(object):
+	def __init__(self, tables=None, records=None):
+		self.tables = tables if tables else {}
+		self.records = records
+
+	@staticmethod
+	def exists(fname):
+		return os.path.exists(fname)
+
+	@staticmethod
+	def load(fname, records=False):
+		'''Load a rollup from disk.
+
+		The per-record contributions are only needed to update a
+		rollup (not to query it) so are only loaded if requested.
+		'''
+		with open(fname, 'r') as f:
+			tables = json.load(f)
+		rollup = Rollup(tables)
+
+		if records:
+			with open(fname + '-records', 'r') as f:
+				rollup.records = json.load(f)
+
+		return rollup
+
+	def save(self, fname):
+		assert self.records is not None
+		with open(fname, 'w') as f:
+			json.dump(self.tables, f, sort_keys=True)
+		with open(fname + '-records', 'w') as f:
+			json.dump(self.records, f, sort_keys=True)
+
+	def _apply(self, contribution, sign):
+		(day, weight, values) = contribution
+		for dim, value in values.items():
+			cells = self.tables.setdefault(dim, {}).setdefault(day, {})
+			cells[value] = cells.get(value, 0) + sign * weight
+			if abs(cells[value]) < 1e-9:
+				del cells[value]
+				if not cells:
+					del self.tables[dim][day]
+
+	def update(self, records, key, date, dimensions, count=lambda r: 1,
+		   segments={}):
+		'''Add (or replace) records in the rollup.
+
+		dimensions is a dictionary mapping each dimension name to a
+		sieve. A sieve that returns None causes the record to be left
+		out of that dimension.
+
+		segments is a dictionary of predicates. Each dimension is
+		also recorded as '<segment>:<dimension>' but only for the
+		records that satisfy the segment's predicate.
+		'''
+		if self.records is None:
+			self.records = {}
+
+		for r in records:
+			k = str(key(r))
+			values = {}
+			for dim, sieve in dimensions.items():
+				v = sieve(r)
+				if v is not None:
+					values[dim] = v
+			for segment, predicate in segments.items():
+				if predicate(r):
+					for dim in dimensions.keys():
+						if dim in values:
+							values[segment + ':' + dim] = values[dim]
+			# Days are UTC (the filter sub-commands compare dates
+			# in UTC and the records can be in any timezone)
+			contribution = [ utc(date(r)).strftime('%Y-%m-%d'),
+					 count(r), values ]
+
+			if k in self.records:
+				if self.records[k] == contribution:
+					continue
+				self._apply(self.records[k], -1)
+			self._apply(contribution, 1)
+			self.records[k] = contribution
+
+	def prune(self, keys):
+		'''Remove every record whose key is not in keys.'''
+		keys = set(str(k) for k in keys)
+		for k in list(self.records.keys()):
+			if k not in keys:
+				self._apply(self.records[k], -1)
+				del self.records[k]
+
+	def __contains__(self, key):
+		return str(key) in self.records
+
+	@staticmethod
+	def days(since, until):
+		'''Convert a since/until pair of datetimes into inclusive days.
+
+		The rollup only knows which (UTC) day each record falls on so
+		both must be at midnight (UTC). since is inclusive and until is
+		exclusive (matching the filter sub-commands) although the last
+		second of a day, as given by date.smart_parse() with end_of_day
+		set, is also accepted as the end of that day. ValueError is
+		raised for any other time of day.
+		'''
+		midnight = datetime.time()
+		first = last = None
+		if since:
+			since = utc(since)
+			if since.time() != midnight:
+				raise ValueError('{} is not midnight (UTC)'.format(since))
+			first = since.strftime('%Y-%m-%d')
+		if until:
+			until = utc(until)
+			if until.time() == midnight:
+				until -= datetime.timedelta(days=1)
+			elif until.time() != datetime.time(23, 59, 59):
+				raise ValueError('{} is not midnight (UTC)'.format(until))
+			last = until.strftime('%Y-%m-%d')
+		return (first, last)
+
+	def table(self, dim, period=by_month, since=None, until=None):
+		'''Tabulate a dimension by period (matches accumulate_2d()).'''
+		(first, last) = self.days(since, until)
+		results = collections.defaultdict(lambda: collections.defaultdict(int))
+		for day, cells in self.tables.get(dim, {}).items():
+			if (first and day < first) or (last and day > last):
+				continue
+			row = results[period(day)]
+			for value, total in cells.items():
+				row[value] += total
+		return results
+
+	def totals(self, dim, since=None, until=None):
+		'''Total a dimension over a date range (matches accumulate()).'''
+		(first, last) = self.days(since, until)
+		results = collections.defaultdict(int)
+		for day, cells in self.tables.get(dim, {}).items():
+			if (first and day < first) or (last and day > last):
+				continue
+			for value, total in cells.items():
+				results[value] += total
+		return results
@@ -0,0 +1,284 @@
+'''
+Synthetic data generators for benchmarking and scale testing.
+
+Each generator produces records shaped like the ones the tools store
+(glance's JIRA issues with attached worklogs, ldtstool's Zendesk tickets
+and 96btool's Discourse posts) at any scale. Generation is deterministic
+for a given seed and the generators are lazy so very large datasets can
+be streamed straight to disk using write_json().
+'''
+
+import datetime
+import json
+import random
+
+# Vocabulary used to populate free text fields
+words = (
+	'android', 'board', 'boot', 'bootloader', 'build', 'camera',
+	'clock', 'debug', 'device', 'display', 'dragonboard', 'driver',
+	'firmware', 'gpio', 'graphics', 'hikey', 'i2c', 'kernel', 'linux',
+	'mainline', 'memory', 'patch', 'performance', 'poplar', 'power',
+	'regression', 'release', 'spi', 'suspend', 'support', 'test',
+	'thermal', 'toolchain', 'uart', 'upstream', 'usb', 'wifi',
+)
+
+engineers = (
+	'Daniel Thompson', 'Leo Yan', 'Loic Poulain', 'Ard Biesheuvel',
+	'Sumit Garg', 'Jorge Ramirez', 'Todor Tomov', 'Srinivas Kandagatla',
+)
+
+members = (
+	'Socionext', 'Hisilicon', 'Qualcomm', 'Marvell', 'Fujitsu',
+	'Huawei', 'ZTE', 'Samsung',
+)
+
+# A subset of glance's component_categories
+categories = (
+	'BSP Analysis', 'Engineering works', 'Member Build', 'Training',
+	'Upstream Consultancy',
+)
+
+statuses = ( 'Open', 'TODO', 'In Progress', 'Resolved', 'Closed' )
+
+# Tags that ldtstool knows how to categorize (or knows to ignore)
+ticket_tags = (
+	'android', 'board', 'kernel', 'power', 'graphics', 'lava', 'qemu',
+	'toolchain', 'security', 'ubuntu', '96boards', 'networking_lng',
+	'socionext', 'hisi', 'qualcomm', 'qualcomm_stp', 'support', 'ti',
+	'general_support', 'level_1', 'level_2',
+)
+
+ticket_statuses = ( 'new', 'open', 'pending', 'solved', 'closed' )
+
+organizations = members + ( 'Segment_Group', 'TI', 'Linaro' )
+
+segment_domains = ( 'arm.com', 'st.com', 'nxp.com', 'mediatek.com' )
+
+# Names match 96btool's category_lookup
+forum_categories = {
+	5: 'General', 9: 'HiKey', 10: 'DragonBoard410c',
+	11: 'Bubblegum-96', 16: 'Poplar Board', 19: 'DragonBoard820c',
+	21: 'Hikey 960', 25: 'Rock960', 29: 'Ultra96',
+}
+
+forum_tags = ( 'hikey', 'wifi', 'android', 'debian', 'kernel', 'camera' )
+
+epoch = datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc)
+
+def sentence(rng, lo=4, hi=12):
+	return ' '.join(rng.choice(words) for i in range(rng.randint(lo, hi)))
+
+def timestamp(rng, span=1095, after=None):
+	'''Pick a random moment within span days of the epoch (or after).'''
+	start = after if after else epoch
+	return start + datetime.timedelta(seconds=rng.randint(0, span * 86400))
+
+def jira_time(d):
+	return d.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+def zendesk_time(d):
+	return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def discourse_time(d):
+	return d.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def email(name, domain='linaro.org'):
+	return '{}@{}'.format(name.lower().replace(' ', '.'), domain)
+
+def person(name):
+	return { 'displayName': name, 'emailAddress': email(name) }
+
+def worklog_comment(rng):
+	progress = '\n'.join('* ' + sentence(rng) for i in range(rng.randint(1, 3)))
+	plans = '\n'.join('* ' + sentence(rng) for i in range(rng.randint(0, 2)))
+	return 'Progress:\n{}\n\nPlans:\n{}'.format(progress, plans)
+
+def jira_issues(count, seed=0, worklogs=4):
+	'''Generate glance issues (roughly one epic for every ten stories).
+
+	Each issue carries, on average, the given number of worklogs.
+	'''
+	rng = random.Random(seed)
+	epics = max(1, count // 10)
+	epic_components = []
+	worklog_id = 1
+
+	for n in range(count):
+		created = timestamp(rng)
+		updated = timestamp(rng, 60, created)
+		status = rng.choice(statuses)
+		key = 'PSE-{}'.format(n + 1)
+		if n < epics:
+			issuetype = 'Epic'
+			components = [ { 'name': rng.choice(members) },
+				       { 'name': rng.choice(categories) } ]
+			epic_components.append(components)
+			parent = None
+		else:
+			# Stories inherit the components of their epic
+			issuetype = 'Story'
+			epic = rng.randint(1, epics)
+			components = epic_components[epic - 1]
+			parent = 'PSE-{}'.format(epic)
+
+		summary = sentence(rng).capitalize()
+		assignee = rng.choice(engineers)
+
+		worklog = []
+		for i in range(rng.randint(0, 2 * worklogs)):
+			started = timestamp(rng, 60, created)
+			seconds = rng.choice((1800, 3600, 7200, 14400, 28800))
+			author = rng.choice(engineers)
+			worklog.append({
+				'id': str(worklog_id),
+				'issueId': str(n + 1),
+				'started': jira_time(started),
+				'created': jira_time(started),
+				'updated': jira_time(started),
+				'timeSpentSeconds': seconds,
+				'timeSpent': '{}h'.format(seconds // 3600) if seconds >= 3600 else '30m',
+				'author': person(author),
+				'updateAuthor': person(author),
+				'comment': worklog_comment(rng),
+			})
+			worklog_id += 1
+		worklog.sort(key=lambda w: w['started'])
+
+		issue = {
+			'id': str(n + 1),
+			'key': key,
+			'summary': summary,
+			'url': 'https://projects.linaro.org/browse/' + key,
+			'worklog': worklog,
+			'fields': {
+				'assignee': person(assignee) if rng.random() > 0.05 else None,
+				'components': components,
+				'created': jira_time(created),
+				'customfield_10005': parent,
+				'issuelinks': [],
+				'issuetype': { 'name': issuetype },
+				'resolutiondate': jira_time(updated) if status in ('Resolved', 'Closed') else None,
+				'status': { 'name': status },
+				'summary': summary,
+				'updated': jira_time(updated),
+			},
+		}
+		if parent:
+			issue['parent'] = parent
+		yield issue
+
+def zendesk_tickets(count, seed=0):
+	'''Generate ldtstool tickets (with organizations and users attached).'''
+	rng = random.Random(seed)
+
+	orgs = [ { 'id': 1000 + i, 'name': name, 'tags': [],
+		   'url': 'https://linaro.zendesk.com/api/v2/organizations/{}.json'.format(1000 + i) }
+			for i, name in enumerate(organizations) ]
+	agents = [ { 'id': 2000 + i, 'name': name, 'email': email(name),
+		     'role': 'agent' } for i, name in enumerate(engineers) ]
+
+	for n in range(count):
+		created = timestamp(rng)
+		updated = timestamp(rng, 90, created)
+
+		org = rng.choice(orgs) if rng.random() > 0.3 else None
+		if org and org['name'] == 'Segment_Group':
+			domain = rng.choice(segment_domains)
+		elif org:
+			domain = org['name'].lower() + '.com'
+		else:
+			domain = rng.choice(('gmail.com', 'example.org', 'yahoo.com'))
+		requester_name = 'User {}'.format(rng.randint(1, max(10, count // 5)))
+		requester = { 'id': 100000 + n, 'name': requester_name,
+			      'email': email(requester_name, domain),
+			      'role': 'end-user' }
+		assignee = rng.choice(agents) if rng.random() > 0.1 else None
+
+		yield {
+			'id': n + 1,
+			'url': 'https://linaro.zendesk.com/api/v2/tickets/{}.json'.format(n + 1),
+			'subject': sentence(rng, 3, 8).capitalize(),
+			'description': '\n'.join(sentence(rng, 8, 20) for i in range(3)),
+			'status': rng.choice(ticket_statuses),
+			'priority': rng.choice(('low', 'normal', 'high', None)),
+			'tags': rng.sample(ticket_tags, rng.randint(1, 3)),
+			'created_at': zendesk_time(created),
+			'updated_at': zendesk_time(updated),
+			'organization_id': org['id'] if org else None,
+			'organization': org,
+			'assignee_id': assignee['id'] if assignee else None,
+			'assignee': assignee,
+			'requester_id': requester['id'],
+			'requester': requester,
+		}
+
+def discourse_posts(count, seed=0, posts_per_topic=8):
+	'''Generate 96btool posts (with topics and users attached).
+
+	Posts in the same topic share a single topic dict, just as they do
+	after a database has been loaded.
+	'''
+	rng = random.Random(seed)
+	users = {}
+	topics = []
+	nusers = max(5, count // 20)
+
+	def get_user(uid):
+		if uid not in users:
+			users[uid] = { 'id': uid, 'username': 'user{}'.format(uid),
+				       'name': 'User {}'.format(uid),
+				       'email': '', 'website': '' }
+		return users[uid]
+
+	for n in range(count):
+		# Start a new topic (with the new post as its first post) or
+		# reply to one of the more recent topics
+		if not topics or rng.random() < 1 / posts_per_topic:
+			user = get_user(rng.randint(1, nusers))
+			created = timestamp(rng) if not topics else \
+				  timestamp(rng, 2, topics[-1]['created'])
+			category_id = rng.choice(list(forum_categories.keys()))
+			topic_id = len(topics) + 1
+			slug = '-'.join(sentence(rng, 3, 6).split())
+			topic = {
+				'id': topic_id,
+				'title': sentence(rng, 3, 10).capitalize(),
+				'archetype': 'regular',
+				'category_id': category_id,
+				'category': forum_categories[category_id],
+				'created_at': discourse_time(created),
+				'slug': slug,
+				'uri': 'https://discuss.96boards.org/t/{}'.format(slug),
+				'user_id': user['id'],
+				'username': user['username'],
+			}
+			topics.append({ 'topic': topic, 'created': created })
+			when = created
+		else:
+			t = topics[-rng.randint(1, min(len(topics), 50))]
+			topic = t['topic']
+			user = get_user(rng.randint(1, nusers))
+			when = timestamp(rng, 14, t['created'])
+
+		yield {
+			'id': n + 1,
+			'topic_id': topic['id'],
+			'user_id': user['id'],
+			'username': user['username'],
+			'created_at': discourse_time(when),
+			'raw': '\n\n'.join(sentence(rng, 10, 30)
+					for i in range(rng.randint(1, 4))),
+			'tags': rng.sample(forum_tags, rng.randint(0, 2)),
+			'topic': topic,
+			'user': user,
+		}
+
+def write_json(fname, records):
+	'''Write records as a JSON list without holding them all in memory.'''
+	with open(fname, 'w') as f:
+		f.write('[')
+		for i, r in enumerate(records):
+			if i:
+				f.write(',\n')
+			f.write(json.dumps(r))
+		f.write(']\n')
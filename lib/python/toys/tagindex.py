@@ -0,0 +1,170 @@
+'''
+Bitmap index from tags to the records that carry them.
+
+Each distinct tag maps to a bitmap (a Python int) with one bit set for
+every record (by position) that has that tag. Tag queries are resolved
+against the sorted dictionary of tags and then combined using bitwise
+operations so they never visit the records themselves:
+
+    index = tagindex.TagIndex.build(tickets, lambda t: t['tags'],
+                                    lambda t: t['id'])
+    ids = index.query('ti and not (ti-internal or test*)')
+
+Each word in a query is matched as a substring of the tags (or exactly,
+if exact is set) and a word ending in * matches the tags that start with
+it. Words can be combined with and, or, not and parentheses.
+
+An index can be saved beside the database it describes (in a file called
+<database>.tags). Like the offset index it records the size and
+modification time of the database so a stale index is never used.
+'''
+
+import bisect
+import json
+import os
+import re
+
+import toys.offsets as offsets
+
+def to_bitmap(positions, size):
+	bits = bytearray((size + 7) // 8)
+	for p in positions:
+		bits[p >> 3] |= 1 << (p & 7)
+	return int.from_bytes(bits, 'little')
+
+def from_bitmap(bitmap, size):
+	'''Return the positions of the set bits (in ascending order).'''
+	positions = []
+	for i, byte in enumerate(bitmap.to_bytes((size + 7) // 8, 'little')):
+		if byte:
+			positions += [ i * 8 + b for b in range(8) if byte & (1 << b) ]
+	return positions
+
+class TagIndex(object):
+	def __init__(self, keys, bitmaps):
+		self.keys = keys
+		self.bitmaps = bitmaps
+		self.tags = sorted(bitmaps)
+
+	@staticmethod
+	def build(records, tags, key):
+		'''Index records (tags and key extract the tags and key of a record)'''
+		keys = []
+		positions = {}
+		for n, r in enumerate(records):
+			keys.append(key(r))
+			for t in tags(r):
+				positions.setdefault(t, []).append(n)
+		return TagIndex(keys, { t: to_bitmap(p, len(keys))
+					for (t, p) in positions.items() })
+
+	@staticmethod
+	def exists(fname):
+		return os.path.exists(fname + '.tags')
+
+	@staticmethod
+	def current(fname):
+		'''Check the index exists and still matches the database.'''
+		try:
+			with open(fname + '.tags') as f:
+				stamp = json.load(f)['stamp']
+			return stamp == offsets.stamp(fname).decode()
+		except (OSError, ValueError, KeyError):
+			return False
+
+	@staticmethod
+	def load(fname):
+		with open(fname + '.tags') as f:
+			data = json.load(f)
+		return TagIndex(data['keys'], { t: int(b, 16)
+					for (t, b) in data['tags'].items() })
+
+	def save(self, fname):
+		'''Save the index beside the database (which must be written first)'''
+		data = {
+			'keys': self.keys,
+			'stamp': offsets.stamp(fname).decode(),
+			'tags': { t: format(b, 'x') for (t, b) in self.bitmaps.items() },
+		}
+		with open(fname + '.tags.tmp', 'w') as f:
+			json.dump(data, f, sort_keys=True)
+		os.replace(fname + '.tags.tmp', fname + '.tags')
+
+	def match(self, word, exact=False):
+		'''Find the bitmap for a single word of a query.'''
+		if exact:
+			return self.bitmaps.get(word, 0)
+
+		if word.endswith('*'):
+			prefix = word[:-1]
+			i = bisect.bisect_left(self.tags, prefix)
+			tags = []
+			while i < len(self.tags) and self.tags[i].startswith(prefix):
+				tags.append(self.tags[i])
+				i += 1
+		else:
+			tags = [ t for t in self.tags if word in t ]
+
+		bitmap = 0
+		for t in tags:
+			bitmap |= self.bitmaps[t]
+		return bitmap
+
+	def bitmap(self, expr, exact=False):
+		'''Evaluate a query, returning a bitmap of the matching records.'''
+		tokens = re.findall(r'[()]|[^\s()]+', expr)
+		everything = (1 << len(self.keys)) - 1
+
+		def error(msg):
+			raise ValueError('{}: {}'.format(expr, msg))
+
+		def peek():
+			return tokens[0] if tokens else None
+
+		def parse_or():
+			bitmap = parse_and()
+			while peek() == 'or':
+				tokens.pop(0)
+				bitmap |= parse_and()
+			return bitmap
+
+		def parse_and():
+			bitmap = parse_not()
+			while peek() == 'and':
+				tokens.pop(0)
+				bitmap &= parse_not()
+			return bitmap
+
+		def parse_not():
+			token = peek()
+			if token is None:
+				error('incomplete tag expression')
+			tokens.pop(0)
+			if token == 'not':
+				return everything & ~parse_not()
+			if token == '(':
+				bitmap = parse_or()
+				if peek() != ')':
+					error('missing )')
+				tokens.pop(0)
+				return bitmap
+			if token in ('and', 'or', ')'):
+				error("unexpected '{}'".format(token))
+			return self.match(token, exact)
+
+		bitmap = parse_or()
+		if tokens:
+			error("unexpected '{}'".format(tokens[0]))
+		return bitmap
+
+	def positions(self, expr, exact=False):
+		'''Return the positions of the records matching a query.'''
+		return from_bitmap(self.bitmap(expr, exact), len(self.keys))
+
+	def query(self, expr, exact=False):
+		'''Return the keys of the records matching a query.'''
+		return [ self.keys[p] for p in self.positions(expr, exact) ]
+
+	def select(self, records, expr, exact=False):
+		'''Filter the records the index was built from using a query.'''
+		return [ records[p] for p in self.positions(expr, exact) ]
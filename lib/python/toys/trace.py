@@ -0,0 +1,159 @@
+'''
+Lightweight instrumentation for finding out where the time goes.
+
+Code is instrumented using spans (a context manager that times a block of
+code) and counters. Both cost almost nothing until tracing is enabled,
+which is normally done using profile() from a tool's main():
+
+    with trace.profile(args.profile, args.cprofile, 'filter'):
+        args.func(args)
+
+The timeline is written in the Chrome trace event format so it can be
+viewed using chrome://tracing (or https://ui.perfetto.dev). The final
+value of every counter, together with the peak RSS of the process, is
+also included (under otherData) for anyone reading the JSON directly.
+'''
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+_enabled = False
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+def enabled():
+	return _enabled
+
+def enable():
+	global _enabled
+	_enabled = True
+
+def _now():
+	'''Microseconds since the module was imported.'''
+	return (time.perf_counter() - _origin) * 1000000
+
+def peak_rss():
+	'''Peak resident set size of the process (in KiB).'''
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# macOS reports bytes rather than KiB
+	return rss // 1024 if sys.platform == 'darwin' else rss
+
+def _emit(event):
+	event['pid'] = os.getpid()
+	event['tid'] = threading.get_ident()
+	with _lock:
+		_events.append(event)
+
+def complete(name, start, duration, cat='toys', **args):
+	'''Record a span that has already finished (times in seconds).
+
+	start is a value from time.perf_counter().
+	'''
+	if not _enabled:
+		return
+	_emit({ 'name': name, 'cat': cat, 'ph': 'X',
+		'ts': (start - _origin) * 1000000, 'dur': duration * 1000000,
+		'args': args })
+
+@contextlib.contextmanager
+def span(name, cat='toys', **args):
+	'''Time the enclosed block of code.'''
+	if not _enabled:
+		yield
+		return
+
+	start = _now()
+	try:
+		yield
+	finally:
+		end = _now()
+		_emit({ 'name': name, 'cat': cat, 'ph': 'X', 'ts': start,
+			'dur': end - start, 'args': args })
+		_emit({ 'name': 'peak_rss_kib', 'ph': 'C', 'ts': end,
+			'args': { 'rss': peak_rss() } })
+
+def traced(name=None, cat='toys'):
+	'''Decorator to wrap every call to a function in a span.'''
+	def decorator(fn):
+		label = name if name else fn.__qualname__
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			if not _enabled:
+				return fn(*args, **kwargs)
+			with span(label, cat):
+				return fn(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def count(name, n=1):
+	'''Increment a counter (counters are grouped by the text before the
+	first dot).'''
+	if not _enabled:
+		return
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + n
+		value = _counters[name]
+	(group, _, series) = name.partition('.')
+	_emit({ 'name': group, 'ph': 'C', 'ts': _now(),
+		'args': { series if series else group: value } })
+
+def filtered(name, records_in, records_out):
+	'''Count the records entering and leaving a filter.'''
+	count('records.{}_in'.format(name), records_in)
+	count('records.{}_out'.format(name), records_out)
+
+def counters():
+	with _lock:
+		return dict(_counters)
+
+def save(fname):
+	'''Write the timeline (and a summary of the counters) to fname.'''
+	with _lock:
+		events = list(_events)
+	trace = {
+		'traceEvents': events,
+		'displayTimeUnit': 'ms',
+		'otherData': {
+			'argv': sys.argv,
+			'counters': counters(),
+			'peak_rss_kib': peak_rss(),
+		},
+	}
+	with open(fname, 'w') as f:
+		json.dump(trace, f)
+
+@contextlib.contextmanager
+def profile(fname=None, cprofile=None, name='main'):
+	'''Trace (and optionally cProfile) the enclosed block of code.
+
+	Does nothing at all unless at least one filename is provided. The
+	results are written even if the block raises an exception.
+	'''
+	if not fname and not cprofile:
+		yield
+		return
+
+	if fname:
+		enable()
+	if cprofile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	try:
+		with span(name):
+			yield
+	finally:
+		if cprofile:
+			profiler.disable()
+			profiler.dump_stats(cprofile)
+		if fname:
+			save(fname)
@@ -0,0 +1,215 @@
+'''
+Persistent trigram index used to shortlist candidates for regex searches.
+
+The index maps every (lower-cased) three character sequence found in a
+document onto the ids of the documents that contain it. It is stored
+using dbm so that a search need only read the postings for the trigrams
+that appear in the pattern.
+
+The index only ever produces a shortlist; callers must still confirm
+each candidate using the regex itself. The shortlist is only correct for
+the documents that were indexed so the index records which database it
+was built from (see mark()) and must only be used to search that
+database, unchanged since it was indexed (see describes()).
+'''
+
+import array
+import dbm
+import os
+
+import toys.offsets as offsets
+
+try:
+	import re._parser as sre_parse
+except ImportError:
+	import sre_parse
+
+# The set of every document id that has been indexed is stored alongside
+# the trigrams (a trigram can never contain a NUL so this cannot clash)
+ALL_IDS = b'\0ids'
+
+# The database the index was built from (and its size and modification
+# time when it was indexed)
+SOURCE = b'\0source'
+
+def trigrams(text):
+	'''Return the set of (lower-cased) trigrams in a string.'''
+	text = text.lower()
+	return set(text[i:i+3] for i in range(len(text) - 2))
+
+def _literals(parsed):
+	'''Find the literal strings that must appear in any match.
+
+	Returns a list of alternatives, each of which is a list of literals
+	(all of which must appear in a match).
+	'''
+	literals = []
+	run = []
+
+	def flush():
+		if run:
+			literals.append(''.join(run))
+			del run[:]
+
+	for op, av in parsed:
+		if op == sre_parse.LITERAL:
+			run.append(chr(av))
+			continue
+
+		flush()
+		if op == sre_parse.SUBPATTERN:
+			# av is (group, add_flags, del_flags, pattern)
+			alternatives = _literals(av[-1])
+			if len(alternatives) == 1:
+				literals += alternatives[0]
+		elif op == sre_parse.MAX_REPEAT or op == sre_parse.MIN_REPEAT:
+			(lo, hi, pattern) = av
+			alternatives = _literals(pattern)
+			if lo >= 1 and len(alternatives) == 1:
+				literals += alternatives[0]
+		elif op == sre_parse.BRANCH and len(parsed) == 1:
+			alternatives = []
+			for branch in av[1]:
+				alternatives += _literals(branch)
+			return alternatives
+	flush()
+
+	return [ literals ]
+
+def required_literals(pattern):
+	'''Find the literal strings that must appear in matches of pattern.
+
+	The result is a list of alternatives; each alternative is a list of
+	strings that must all appear in the text. An alternative that is
+	empty matches everything.
+	'''
+	if not isinstance(pattern, str):
+		pattern = pattern.pattern
+	return _literals(sre_parse.parse(pattern))
+
+class TrigramIndex(object):
+	def __init__(self, fname, flag='r'):
+		self.fname = fname
+		self.db = dbm.open(fname, flag)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.db.close()
+
+	@staticmethod
+	def exists(fname):
+		return dbm.whichdb(fname) not in (None, '')
+
+	@staticmethod
+	def remove(fname):
+		'''Delete an index (dbm may have spread it over several files)'''
+		for ext in ('', '.db', '.dat', '.dir', '.bak', '.pag'):
+			if os.path.exists(fname + ext):
+				os.remove(fname + ext)
+
+	def _get(self, key):
+		postings = array.array('I')
+		try:
+			postings.frombytes(self.db[key])
+		except KeyError:
+			pass
+		return postings
+
+	def ids(self):
+		'''Return the set of document ids that have been indexed.'''
+		return set(self._get(ALL_IDS))
+
+	def update(self, docs):
+		'''Add documents, given as (id, text) pairs, to the index.
+
+		Documents that have already been indexed are ignored.
+		'''
+		indexed = self.ids()
+		additions = {}
+		new_ids = array.array('I')
+		for (doc_id, text) in docs:
+			if doc_id in indexed:
+				continue
+			indexed.add(doc_id)
+			new_ids.append(doc_id)
+			for t in trigrams(text):
+				if t not in additions:
+					additions[t] = array.array('I')
+				additions[t].append(doc_id)
+
+		for t, ids in additions.items():
+			key = t.encode('UTF-8')
+			postings = self._get(key)
+			postings.extend(ids)
+			self.db[key] = postings.tobytes()
+
+		if new_ids:
+			postings = self._get(ALL_IDS)
+			postings.extend(new_ids)
+			self.db[ALL_IDS] = postings.tobytes()
+
+		return len(new_ids)
+
+	def source(self, fname):
+		return os.path.abspath(fname).encode('UTF-8') + b'\0' + \
+		       offsets.stamp(fname)
+
+	def mark(self, fname):
+		'''Record that the index now describes the database fname.'''
+		self.db[SOURCE] = self.source(fname)
+
+	def describes(self, fname):
+		'''Check the index was built from fname (and fname hasn't changed).'''
+		try:
+			return self.db[SOURCE] == self.source(fname)
+		except (KeyError, OSError):
+			return False
+
+	def lookup(self, literal):
+		'''Find the ids of documents that might contain literal.
+
+		Returns None if the literal is too short to be looked up.
+		'''
+		grams = trigrams(literal)
+		if not grams:
+			return None
+
+		# Start with the rarest trigram so the intersection stays small
+		postings = sorted((self._get(t.encode('UTF-8')) for t in grams),
+				  key=len)
+		candidates = set(postings[0])
+		for p in postings[1:]:
+			if not candidates:
+				break
+			candidates.intersection_update(p)
+		return candidates
+
+	def search(self, pattern):
+		'''Find the ids of documents that might match a regex.
+
+		Returns None if the pattern cannot be used to shortlist
+		documents (in which case every document is a candidate).
+		'''
+		try:
+			alternatives = required_literals(pattern)
+		except Exception:
+			return None
+
+		candidates = set()
+		for literals in alternatives:
+			matches = None
+			for l in literals:
+				found = self.lookup(l)
+				if found is None:
+					continue
+				matches = found if matches is None else matches & found
+			if matches is None:
+				return None
+			candidates |= matches
+
+		return candidates
@@ -19,32 +19,74 @@
 #   python -m unittest --verbose \
 #       kbuildtest.TestArm64KernelBuilds.test_defconfig
 #
+# Builds can be warm started using ccache (--ccache) and/or by keeping a
+# copy of the objdir for every .config that is built (--warm-cache DIR).
+# These can also be enabled using KBUILDTEST_CCACHE=1 and
+# KBUILDTEST_WARM_CACHE=DIR (which is useful with python -m unittest).
+#
+# When run directly several configs are built at once (see --builds).
+# All the builds share a single make jobserver so the total number of
+# jobs never exceeds --jobs (which defaults to $JOBS or the number of
+# CPUs). Configs are started longest first, based on the build times
+# recorded in the summary (objdir-summary.json) by the previous run:
+#
+#   nice ionice <path_to>/kbuildtest.py --builds 4 \
+#       TestArm64KernelBuilds TestX86KernelBuilds.test_defconfig
+#
 
 #
 # Note:
 #   If you don't have python3 try in python2... it will probably just work
 #
 
+import argparse
+import contextlib
+import hashlib
+import json
 import os
+import subprocess
+import sys
+import threading
+import time
 import unittest
 
 #
 # Utility class
 #
 
+# Set by the scheduler when the builds share a jobserver (this holds the
+# MAKEFLAGS needed to join it and the file descriptors of its pipe)
+jobserver = None
+
+# Optional ways to avoid rebuilding things we have built before
+use_ccache = bool(os.environ.get('KBUILDTEST_CCACHE'))
+warm_cache = os.environ.get('KBUILDTEST_WARM_CACHE')
+
 class KbuildSuite(unittest.TestCase):
+    # Each build has its own environment (rather than modifying
+    # os.environ) so that several builds can run at once.
     def setUpAndApplyConfig(self, arch, cross_compile, toolchain):
-        os.environ['ARCH'] = arch
+        self.env = dict(os.environ)
+        self.env['ARCH'] = arch
+        self.cpu_time = 0.0
+        self.builds = 0
+        self.pending = None
 
         if cross_compile:
-            os.environ['CROSS_COMPILE'] = cross_compile
+            self.env['CROSS_COMPILE'] = cross_compile
         else:
-            if 'CROSS_COMPILE' in os.environ:
-                del os.environ['CROSS_COMPILE']
+            if 'CROSS_COMPILE' in self.env:
+                del self.env['CROSS_COMPILE']
 
-        self.origpath = os.environ['PATH']
         if toolchain:
-            os.environ['PATH'] = toolchain + '/bin:' + os.environ['PATH']
+            self.env['PATH'] = toolchain + '/bin:' + self.env['PATH']
+
+        if jobserver:
+            self.env['MAKEFLAGS'] = jobserver['makeflags']
+
+        if use_ccache:
+            # Let objdirs share cache hits
+            self.env['CCACHE_BASEDIR'] = os.getcwd()
 
         testname = str(self).split()[0]
         self.board = testname[5:]
@@ -57,7 +99,7 @@ class KbuildSuite(unittest.TestCase):
         if config_rule.startswith('defconfig_'):
             config_rule = 'defconfig'
 
-        exit_code = os.system('make O=%s %s > %s/lastbuild.log 2>&1'
+        exit_code = self.system('make O=%s %s > %s/lastbuild.log 2>&1'
                 % (self.objdir, config_rule, self.objdir))
         self.assertEqual(0, exit_code,
             'Initial config failed: See "%s/lastbuild.log"' % (self.objdir,))
@@ -66,37 +108,73 @@ class KbuildSuite(unittest.TestCase):
         f.write('*\n')
         f.close()
 
-    def tearDown(self):
-        # Every single test impacts ARCH and CROSS_COMPILE so we will
-        # leave them alone.
-        os.environ['PATH'] = self.origpath
+    def system(self, cmd):
+        """Run a shell command (much like os.system()) in our environment.
 
-    def config(self, enable=(), disable=(), module=()):
-        if isinstance(enable, str):
-            enable = (enable,)
-        enable = ' '.join([ '--enable ' + x for x in enable ])
+        The CPU time used by the command is added to self.cpu_time.
+        """
+        fds = (jobserver['r'], jobserver['w']) if jobserver else ()
+        p = subprocess.Popen(cmd, shell=True, env=self.env, pass_fds=fds)
+        (pid, status, usage) = os.wait4(p.pid, 0)
+        p.returncode = status
+        self.cpu_time += usage.ru_utime + usage.ru_stime
+        return status
 
-        if isinstance(disable, str):
-            disable = (disable,)
-        disable = ' '.join([ '--disable ' + x for x in disable ])
+    def config(self, enable=(), disable=(), module=()):
+        """Change the config and rebuild.
+
+        Within a transaction() the changes are only recorded and the
+        rebuild happens when the transaction is committed.
+        """
+        args = []
+        for (opt, symbols) in (('--enable', enable), ('--module', module),
+                               ('--disable', disable)):
+            if isinstance(symbols, str):
+                symbols = (symbols,)
+            args += [ opt + ' ' + x for x in symbols ]
+
+        if self.pending is not None:
+            self.pending += args
+            return
+
+        self.apply_config(args)
+        self.make()
 
-        if isinstance(module, str):
-            module = (module,)
-        module = ' '.join([ '--module ' + x for x in module ])
+    @contextlib.contextmanager
+    def transaction(self):
+        """Batch several config changes together:
+
+            with self.transaction():
+                self.config_modernize()
+                self.config_kgdb()
+
+        The changes are applied (in order) using a single run of
+        scripts/config and olddefconfig and then the kernel is built once.
+        """
+        assert self.pending is None
+        self.pending = []
+        try:
+            yield
+            args = self.pending
+        finally:
+            self.pending = None
+
+        if args:
+            self.apply_config(args)
+        self.make()
 
-        exit_code = os.system(
-            'scripts/config --file %s/.config %s %s %s >> %s/lastbuild.log 2>&1'
-                % (self.objdir, enable, module, disable, self.objdir))
+    def apply_config(self, args):
+        exit_code = self.system(
+            'scripts/config --file %s/.config %s >> %s/lastbuild.log 2>&1'
+                % (self.objdir, ' '.join(args), self.objdir))
         self.assertEqual(0, exit_code,
             'Config failed: See "%s/lastbuild.log"' % (self.objdir,))
 
-        exit_code = os.system('make -C %s olddefconfig > %s/lastbuild.log 2>&1'
+        exit_code = self.system('make -C %s olddefconfig >> %s/lastbuild.log 2>&1'
                 % (self.objdir, self.objdir))
         self.assertEqual(0, exit_code,
             'olddefconfig failed: See "%s/lastbuild.log"' % (self.objdir,))
 
-        self.make()
-
     def config_modernize(self):
         # Ensure the kernel can support:
         #   recent udev
@@ -112,14 +190,71 @@ class KbuildSuite(unittest.TestCase):
                      'KGDB', 'KGDB_KDB'))
 
     def make(self, cmd=''):
-        if 'JOBS' in os.environ:
-            jobs = os.environ['JOBS']
+        if jobserver:
+            # MAKEFLAGS tells make to take its jobs from the jobserver
+            jobs = ''
+        elif 'JOBS' in os.environ:
+            jobs = '-j ' + os.environ['JOBS']
         else:
-            jobs = os.sysconf('SC_NPROCESSORS_ONLN')
-        exit_code = os.system('make -C %s -j %s %s >> %s/lastbuild.log 2>&1'
+            jobs = '-j %d' % os.sysconf('SC_NPROCESSORS_ONLN')
+        if use_ccache:
+            jobs += ' CC="ccache %sgcc"' % self.env.get('CROSS_COMPILE', '')
+
+        if warm_cache and not cmd:
+            self.warm_start()
+        self.builds += 1
+        exit_code = self.system('make -C %s %s %s >> %s/lastbuild.log 2>&1'
             % (self.objdir, jobs, cmd, self.objdir))
         self.assertEqual(0, exit_code,
             'Build failed: See "%s/lastbuild.log"' % (self.objdir))
+        if warm_cache and not cmd:
+            self.save_warm_start()
+
+    def config_hash(self):
+        """Identify a build by its .config (and how it was compiled)."""
+        h = hashlib.sha1()
+        for v in (self.objdir, self.env['ARCH'],
+                  self.env.get('CROSS_COMPILE', ''), self.env['PATH']):
+            h.update(v.encode('UTF-8') + b'\0')
+        with open(self.objdir + '/.config', 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def warm_start(self):
+        """Restore an earlier build of the same .config (if there is one)."""
+        key = self.config_hash()
+        stamp = self.objdir + '/.kbuildtest-config'
+        if os.path.exists(stamp) and open(stamp).read() == key:
+            return
+
+        snapshot = os.path.join(warm_cache, key)
+        if not os.path.isdir(snapshot):
+            return
+
+        exit_code = self.system(
+            'mv %(o)s/lastbuild.log %(o)s.log && rm -rf %(o)s && '
+            'cp -a --reflink=auto %(s)s %(o)s && mv %(o)s.log %(o)s/lastbuild.log'
+                % { 'o': self.objdir, 's': snapshot })
+        self.assertEqual(0, exit_code,
+            'Cannot warm start from %s' % (snapshot,))
+
+    def save_warm_start(self):
+        key = self.config_hash()
+        with open(self.objdir + '/.kbuildtest-config', 'w') as f:
+            f.write(key)
+
+        snapshot = os.path.join(warm_cache, key)
+        if os.path.isdir(snapshot):
+            return
+
+        # Copy to a temporary name so a half finished copy is never used
+        if not os.path.isdir(warm_cache):
+            os.makedirs(warm_cache)
+        exit_code = self.system(
+            'rm -rf %(s)s.tmp && cp -a --reflink=auto %(o)s %(s)s.tmp && '
+            'mv %(s)s.tmp %(s)s' % { 'o': self.objdir, 's': snapshot })
+        self.assertEqual(0, exit_code,
+            'Cannot save %s to %s' % (self.objdir, snapshot))
 
 #
 # ARM
@@ -154,9 +289,9 @@ class TestArmKernelBuilds(KbuildSuite):
 
     def test_multi_v7_defconfig(self):
         self.make()
-        self.config_modernize()
-        self.config_kgdb()
-        self.make()
+        with self.transaction():
+            self.config_modernize()
+            self.config_kgdb()
 
     def test_netx_defconfig(self):
         self.make()
@@ -181,9 +316,10 @@ class TestArmKernelBuilds(KbuildSuite):
 
     def test_versatile_defconfig(self):
         self.make()
-        self.config(disable='DEBUG_LL')
-        self.config_modernize()
-        self.config_kgdb()
+        with self.transaction():
+            self.config(disable='DEBUG_LL')
+            self.config_modernize()
+            self.config_kgdb()
 
 #
 # ARM64
@@ -199,7 +335,6 @@ class TestArm64KernelBuilds(KbuildSuite):
 
     def test_defconfig_kgdb(self):
         self.config_kgdb()
-        self.make()
 
     def xtest_allyesconfig(self):
         self.make()
@@ -236,7 +371,6 @@ class TestPowerpcKernelBuilds(KbuildSuite):
 
     def test_defconfig_kgdb(self):
         self.config_kgdb()
-        self.make()
 
 #
 # X86
@@ -257,7 +391,6 @@ class TestX86KernelBuilds(KbuildSuite):
 
     def test_defconfig_kgdb(self):
         self.config_kgdb()
-        self.make()
 
     def test_allyesconfig(self):
         self.make()
@@ -266,8 +399,147 @@ class TestX86KernelBuilds(KbuildSuite):
         self.make()
 
 #
-# Basic test runner
+# Parallel test runner
 #
 
+def make_jobserver(jobs):
+    """Create a GNU make jobserver that allows jobs at once.
+
+    The scheduler takes a token for every build it starts so that the
+    job each make runs without a token is also accounted for.
+    """
+    (r, w) = os.pipe()
+    os.write(w, b'+' * jobs)
+    return {
+        'r': r,
+        'w': w,
+        'makeflags': ' -j%d --jobserver-auth=%d,%d --jobserver-fds=%d,%d'
+                % (jobs, r, w, r, w),
+    }
+
+def load_summary(fname):
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def config_name(test):
+    # e.g. TestArm64KernelBuilds.test_defconfig
+    return '.'.join(test.id().split('.')[-2:])
+
+def all_tests(suite):
+    for t in suite:
+        if isinstance(t, unittest.TestSuite):
+            for tt in all_tests(t):
+                yield tt
+        else:
+            yield t
+
+class Scheduler(object):
+    def __init__(self, tests, builds, history):
+        # Longest first (and anything we haven't built before first
+        # of all because we don't know how long it will take)
+        self.queue = sorted(tests, key=lambda t: -history.get(
+                config_name(t), {}).get('wall', float('inf')))
+        self.builds = builds
+        self.lock = threading.Lock()
+        self.summary = {}
+        self.failures = []
+
+    def run_one(self, test):
+        token = os.read(jobserver['r'], 1)
+        try:
+            result = unittest.TestResult()
+            start = time.time()
+            test.run(result)
+            wall = time.time() - start
+        finally:
+            os.write(jobserver['w'], token)
+
+        if result.errors:
+            status = 'error'
+        elif result.failures:
+            status = 'fail'
+        elif result.skipped:
+            status = 'skip'
+        else:
+            status = 'ok'
+
+        name = config_name(test)
+        with self.lock:
+            self.summary[name] = {
+                'builds': getattr(test, 'builds', 0),
+                'status': status,
+                'wall': round(wall, 1),
+                'cpu': round(getattr(test, 'cpu_time', 0.0), 1),
+            }
+            self.failures += result.errors + result.failures
+            print('%-50s %-5s %4dm%02ds' % (name, status,
+                    wall // 60, wall % 60))
+            sys.stdout.flush()
+
+    def worker(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return
+                test = self.queue.pop(0)
+            self.run_one(test)
+
+    def run(self):
+        threads = [ threading.Thread(target=self.worker)
+                        for i in range(self.builds) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for (test, trace) in self.failures:
+            print('\n%s\n%s' % (test.id(), trace))
+
 if __name__ == '__main__':
-    unittest.main()
+    if 'JOBS' in os.environ:
+        default_jobs = int(os.environ['JOBS'])
+    else:
+        default_jobs = os.sysconf('SC_NPROCESSORS_ONLN')
+
+    parser = argparse.ArgumentParser(
+            description='Build test a wide range of kernels')
+    parser.add_argument('--builds', type=int, default=2,
+            help='Number of configs to build at once')
+    parser.add_argument('--ccache', action='store_true',
+            help='Compile using ccache')
+    parser.add_argument('--jobs', '-j', type=int, default=default_jobs,
+            help='Total number of jobs shared by all the builds')
+    parser.add_argument('--summary', default='objdir-summary.json',
+            help='Where to record the build times (and results)')
+    parser.add_argument('--warm-cache', metavar='DIR',
+            help='Keep a copy of each objdir (by .config) to warm start from')
+    parser.add_argument('tests', nargs='*',
+            help='Test classes or methods to run (default: everything)')
+    args = parser.parse_args()
+
+    loader = unittest.TestLoader()
+    module = sys.modules[__name__]
+    if args.tests:
+        suite = loader.loadTestsFromNames(args.tests, module)
+    else:
+        suite = loader.loadTestsFromModule(module)
+
+    if args.ccache:
+        use_ccache = True
+    if args.warm_cache:
+        warm_cache = os.path.abspath(args.warm_cache)
+
+    history = load_summary(args.summary)
+    jobserver = make_jobserver(max(args.jobs, args.builds))
+    scheduler = Scheduler(list(all_tests(suite)), args.builds, history)
+    scheduler.run()
+
+    # Keep the times of configs we didn't build this time around
+    history.update(scheduler.summary)
+    with open(args.summary, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+    sys.exit(1 if scheduler.failures else 0)
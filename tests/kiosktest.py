@@ -7,15 +7,181 @@
 # feature.
 #
 
+import atexit
+import os
 import unittest
 import pexpect	   # Needs to be pexpect >= 3.1
 import pxssh
+import threading
 import time
 import sys
 
 UARTCMD='telnet agnes.lan 5331'
 TARGETIP='192.168.1.39'
 
+# Several targets (or QEMU instances) can be tested in parallel by
+# listing them, separated by semicolons, as <uart command>=<ip>[:<port>]:
+#
+#   KIOSKTEST_TARGETS='telnet localhost 5331=localhost:2201;
+#                      telnet localhost 5332=localhost:2202' kiosktest.py
+#
+TARGETS=os.environ.get('KIOSKTEST_TARGETS', UARTCMD + '=' + TARGETIP)
+
+class Target(object):
+	"""The sessions used to test a single target.
+
+	Each session is opened when it is first used. If the sessions are
+	left in a bad state they can be closed using disconnect() and they
+	will be reopened when next needed.
+
+	"""
+	def __init__(self, spec):
+		(self.uartcmd, ip) = spec.strip().rsplit('=', 1)
+		(self.ip, _, port) = ip.partition(':')
+		self.port = int(port) if port else None
+		self._uart = None
+		self._mgr = None
+
+	def __str__(self):
+		return self.ip if not self.port else '%s:%d' % (self.ip, self.port)
+
+	@property
+	def uart(self):
+		if not self._uart:
+			#uart = pexpect.spawn('target-jei-serial agnes.lan')
+			uart = pexpect.spawn(self.uartcmd, timeout=10)
+			uart.expect('Connected to ')
+			uart.expect('Escape character is')
+			# Make absolutely sure the target is running (otherwise
+			# SSH interaction will fail)
+			uart.send('q\r') # break out of the pager
+			uart.send('go\r') # set the target running
+			#uart.logfile = sys.stdout
+			self._uart = uart
+		return self._uart
+
+	@property
+	def mgr(self):
+		if not self._mgr:
+			self.uart	# Open the UART first (see above)
+			mgr = pxssh.pxssh()
+			mgr.login(self.ip, 'root', port=self.port)
+			self._mgr = mgr
+		return self._mgr
+
+	def disconnect(self):
+		for s in (self._uart, self._mgr):
+			try:
+				if s:
+					s.close()
+			except:
+				pass
+		self._uart = None
+		self._mgr = None
+
+class SessionPool(object):
+	"""The targets (and their sessions) shared by every test.
+
+	Opening the sessions takes about two seconds so reusing them is
+	important because it means we can write smaller and more focused
+	test cases without a sprawling execution time.
+
+	"""
+	def __init__(self, specs):
+		self.targets = [ Target(s) for s in specs.split(';') if s.strip() ]
+		self.free = list(self.targets)
+		self.cond = threading.Condition()
+
+	def __len__(self):
+		return len(self.targets)
+
+	def acquire(self):
+		with self.cond:
+			while not self.free:
+				self.cond.wait()
+			return self.free.pop(0)
+
+	def release(self, target):
+		with self.cond:
+			self.free.append(target)
+			self.cond.notify()
+
+	def close(self):
+		for t in self.targets:
+			t.disconnect()
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+	"""Get the pool (shared by all test classes and modules)."""
+	global pool
+	with pool_lock:
+		if not pool:
+			pool = SessionPool(TARGETS)
+			atexit.register(pool.close)
+	return pool
+
+class LockedResult(object):
+	"""Serialize calls to a TestResult (which is not thread safe)."""
+	def __init__(self, result, lock):
+		self.result = result
+		self.lock = lock
+
+	def __getattr__(self, name):
+		attr = getattr(self.result, name)
+		if not callable(attr):
+			return attr
+		def locked(*args, **kwargs):
+			with self.lock:
+				return attr(*args, **kwargs)
+		return locked
+
+class ParallelSuite(unittest.TestSuite):
+	"""Run a suite using a thread for each target in the pool."""
+	def __init__(self, suite, jobs):
+		unittest.TestSuite.__init__(self)
+		self.tests = list(self.flatten(suite))
+		self.jobs = jobs
+
+	def flatten(self, suite):
+		if isinstance(suite, unittest.TestSuite):
+			for t in suite:
+				for u in self.flatten(t):
+					yield u
+		else:
+			yield suite
+
+	def countTestCases(self):
+		return len(self.tests)
+
+	def run(self, result):
+		lock = threading.Lock()
+		locked = LockedResult(result, lock)
+		tests = list(self.tests)
+
+		def worker():
+			while not result.shouldStop:
+				with lock:
+					if not tests:
+						return
+					test = tests.pop(0)
+				test(locked)
+
+		threads = [ threading.Thread(target=worker)
+				for i in range(min(self.jobs, len(tests))) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		return result
+
+class ParallelRunner(unittest.TextTestRunner):
+	"""Spread the tests across every target in the pool."""
+	def run(self, test):
+		return unittest.TextTestRunner.run(self,
+				ParallelSuite(test, len(get_pool())))
+
 class TestKdbKiosk(unittest.TestCase):
 	"""A collection of tests for kdb's kiosk mode.
 
@@ -27,38 +193,36 @@ class TestKdbKiosk(unittest.TestCase):
 	The SSH session is used to change sysfs settings, to make other
 	administrative changes to the target and to trigger entry into
 	the debugger. The UART session is used for everything else.
+
+	Both sessions belong to a target borrowed from the session pool
+	for the duration of each test.
 	
 	"""
 
-	@classmethod
-	def setUpClass(cls):
-		"""Open network connections that can be reused.
-
-		This optimization is important because it saves us about
-		two seconds per test meaning we can write smaller and more
-		focused test cases without a sprawling execution time.
+	@property
+	def uart(self):
+		return self.target.uart
 
-		"""
-                #cls.uart = pexpect.spawn('target-jei-serial agnes.lan')
-		cls.uart = pexpect.spawn(UARTCMD, timeout=10)
-		cls.uart.expect('Connected to ')
-		cls.uart.expect('Escape character is')
-		# Make absolutely sure the target is running (otherwise
-		# SSH interaction will fail)
-		cls.uart.send('q\r') # break out of the pager
-		cls.uart.send('go\r') # set the target running
-		#cls.uart.logfile = sys.stdout
-
-		cls.mgr = pxssh.pxssh()
-		cls.mgr.login(TARGETIP, 'root')
-
-	@classmethod
-	def tearDownClass(cls):
-		cls = cls
-		cls.uart.close()
-		cls.mgr.close()
+	@property
+	def mgr(self):
+		return self.target.mgr
 
 	def setUp(self):
+		self.target = get_pool().acquire()
+		try:
+			try:
+				self.prepare()
+			except (pexpect.EOF, pexpect.TIMEOUT):
+				# The sessions were left in a bad state (or the
+				# target rebooted); reconnect and try again
+				self.target.disconnect()
+				self.prepare()
+		except:
+			self.target.disconnect()
+			get_pool().release(self.target)
+			raise
+
+	def prepare(self):
 		# Automatically select the right default kdb operating mode
 		testname = str(self).split()[0]
 		if 'kiosk' in testname.lower():
@@ -71,10 +235,15 @@ class TestKdbKiosk(unittest.TestCase):
 		self.triggerInterrupt()
 
 	def tearDown(self):
-		# Make absolutely sure the target is running before we
-		# manipulate the target via SSH
-		self.sendCommand('q') # break out of the pager
-		self.sendCommand('go') # set the target running
+		try:
+			# Make absolutely sure the target is running before we
+			# manipulate the target via SSH
+			self.sendCommand('q') # break out of the pager
+			self.sendCommand('go') # set the target running
+		except:
+			self.target.disconnect()
+		finally:
+			get_pool().release(self.target)
 
 		# TODO: Clear out the old history so it doesn't risk
 		#       damaging the next test.
@@ -259,4 +428,4 @@ class TestKdbKiosk(unittest.TestCase):
 		self.assertEqual(i, 0)
 
 if __name__ == '__main__':
-	unittest.main()
+	unittest.main(testRunner=ParallelRunner)
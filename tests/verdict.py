@@ -5,10 +5,35 @@
 #
 # Library functions for runtime verdict generation
 #
+# The environment can be used to run several verdicts at once (see
+# verdict_farm.py):
+#
+#   VERDICT_BUILD_ONLY    - exit (with success) when the build is done
+#                           (i.e. just before the target is booted)
+#   VERDICT_SKIP_BUILD    - the tree has already been built; don't build it
+#   VERDICT_INSTANCE      - appended to LOCALVERSION (so modules_install
+#                           doesn't collide with other instances)
+#   VERDICT_JOBS          - number of jobs to give make (default 8)
+#   VERDICT_SERIAL_PORT   - TCP port to use for the (local) serial console
+#                           instead of the one the verdict asks for
+#
+# Console output is not copied to stdout. Instead it is timestamped and
+# captured to a compressed log file which is started afresh every
+# VERDICT_LOG_SIZE bytes (console.log.gz, console.log.001.gz, ...):
+#
+#   VERDICT_LOG           - where to capture the console (default
+#                           verdict-console.log.gz, or '-' for stdout)
+#   VERDICT_LOG_SIZE      - size of each part of the log (default 64MiB)
+#   VERDICT_SEARCH_WINDOW - how much of the console expect() searches
+#                           (default 8192 bytes)
+#
 
 from __future__ import print_function
 
+import atexit
+import gzip
 import os
+import re
 import pexpect
 import pexpect.fdpexpect
 import time
@@ -28,12 +53,14 @@ def run(cmd):
 def skip(msg):
 	"""Exception handler with return code causing bisect to skip."""
 	traceback.print_exc()
+	print_console_log()
 	print('### SKIP: %s ###' % (msg,))
 	sys.exit(125) # skip
 
 def bad(msg):
 	"""Exception handler causing bisect to mark revision bad."""
 	traceback.print_exc()
+	print_console_log()
 	print('### BAD: %s ###' % (msg,))
 	sys.exit(1)
 
@@ -53,49 +80,190 @@ def destringize(s):
 	return s
 
 def build(cmds=(), modules=True):
+	if os.environ.get('VERDICT_SKIP_BUILD'):
+		return
+
 	try:
 		for cmd in destringize(cmds):
 			run(cmd)
 
 		# Avoid collisions in /lib/modules by setting the local version
 		# to our username.
-		run('scripts/config --set-str LOCALVERSION -$USER-')
-		#run('make CC="ccache %sgcc" -j 8' % (os.environ['CROSS_COMPILE'],))
-		run('make -j 8')
+		run('scripts/config --set-str LOCALVERSION -$USER-%s' %
+				(os.environ.get('VERDICT_INSTANCE', ''),))
+		jobs = os.environ.get('VERDICT_JOBS', '8')
+		#run('make CC="ccache %sgcc" -j %s' % (os.environ['CROSS_COMPILE'], jobs))
+		run('make -j %s' % (jobs,))
 		if modules:
 			run('make INSTALL_MOD_PATH=/opt/debian/jessie-armel-rootfs modules_install')
 	except:
 		skip("Cannot compile")
 
-def serial(port, baud=115200, logfile=sys.stdout):
+def built():
+	"""Stop a build-only run once the verdict is ready to boot.
+
+	Verdicts may call build() several times (to modify the config, for
+	example) so we can't stop until the verdict tries to boot.
+	"""
+	if os.environ.get('VERDICT_BUILD_ONLY'):
+		print('\n### BUILT ###')
+		sys.exit(0)
+
+class ConsoleLog(object):
+	"""Timestamped console capture written to rotating gzip files.
+
+	Each line is prefixed with the time it arrived and once a file has
+	grown to max_bytes the next one is started. None of the files are
+	ever removed so the full log is always kept.
+	"""
+	def __init__(self, fname, max_bytes):
+		self.fname = fname
+		self.max_bytes = max_bytes
+		self.segment = 0
+		self.bol = True
+		self.flushed = 0
+		self.open()
+
+	def filename(self, segment):
+		if not segment:
+			return self.fname
+		(base, ext) = os.path.splitext(self.fname)
+		return '%s.%03d%s' % (base, segment, ext)
+
+	def open(self):
+		self.f = gzip.open(self.filename(self.segment), 'wb')
+		self.size = 0
+
+	def rotate(self):
+		self.f.close()
+		self.segment += 1
+		self.open()
+
+	def write(self, data):
+		if not isinstance(data, bytes):
+			data = data.encode('UTF-8', 'replace')
+		lines = data.split(b'\n')
+		for (i, line) in enumerate(lines):
+			eol = i < len(lines) - 1
+			if not line and not eol:
+				break
+			if self.bol:
+				self.f.write(timestamp())
+			self.f.write(line + b'\n' if eol else line)
+			self.size += len(line) + eol
+			self.bol = eol
+
+			# Only start a new file at the end of a line
+			if self.bol and self.size >= self.max_bytes:
+				self.rotate()
+
+	def flush(self):
+		# pexpect flushes after every read; syncing the gzip stream that
+		# often would ruin the compression so limit it to once a second
+		now = time.time()
+		if now - self.flushed >= 1:
+			self.f.flush()
+			self.flushed = now
+
+	def close(self):
+		self.f.close()
+
+def timestamp():
+	now = time.time()
+	return (time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now)) +
+			'.%03d ' % (int(now * 1000) % 1000,)).encode()
+
+console = None
+
+def console_log():
+	"""Find (or create) the log that all consoles are captured to."""
+	global console
+
+	fname = os.environ.get('VERDICT_LOG', 'verdict-console.log.gz')
+	if fname == '-':
+		return sys.stdout
+	if not console:
+		size = int(os.environ.get('VERDICT_LOG_SIZE', 64 * 1024 * 1024))
+		console = ConsoleLog(fname, size)
+		atexit.register(console.close)
+	return console
+
+def print_console_log():
+	if console:
+		console.flush()
+		print('### Console log: %s ###' % (console.filename(console.segment),))
+
+class Session(pexpect.spawn):
+	"""A pexpect session with a bounded search window.
+
+	Only the last searchwindowsize bytes of the console are searched
+	(and kept) so noisy consoles don't make each expect() slower than
+	the last. Pattern lists are compiled once and then reused.
+	"""
+	def __init__(self, cmd, logfile=None):
+		window = int(os.environ.get('VERDICT_SEARCH_WINDOW', 8192))
+		# Data read in a single chunk larger than the window is only
+		# partially searched so keep the reads smaller
+		pexpect.spawn.__init__(self, cmd, logfile=logfile,
+				maxread=min(2000, window // 2),
+				searchwindowsize=window)
+		self.compiled = {}
+
+	def expect(self, pattern, timeout=-1, searchwindowsize=-1, **kwargs):
+		key = pattern if not isinstance(pattern, list) else tuple(pattern)
+		if key not in self.compiled:
+			self.compiled[key] = self.compile_pattern_list(pattern)
+		return self.expect_list(self.compiled[key], timeout,
+				searchwindowsize, **kwargs)
+
+def spawn(cmd, logfile=None):
+	"""Start a console session (logging to the console log by default)."""
+	return Session(cmd, logfile if logfile else console_log())
+
+# Serial ports that qemu() has moved (see serial_port())
+remapped_ports = {}
+
+def serial_port(port):
+	"""Find the port to use for a local serial console.
+
+	This is normally the port the verdict asks for but each instance
+	run by verdict_farm.py is given a port of its own.
+	"""
+	return int(os.environ.get('VERDICT_SERIAL_PORT', port))
+
+def serial(port, baud=115200, logfile=None):
 	"""Connect to serial port with automatic failure reporting."""
 	try:
-		return pexpect.spawn('socat - %s,raw,echo=0,ispeed=%d,ospeed=%d' % (port, baud, baud), logfile=logfile)
+		return spawn('socat - %s,raw,echo=0,ispeed=%d,ospeed=%d' % (port, baud, baud), logfile=logfile)
 	except:
 		bad("Cannot open %s" % (port,))
 
-def telnet(host, port=23, logfile=sys.stdout):
+def telnet(host, port=23, logfile=None):
 	"""Connect to telnet socket with automatic failure reporting."""
+	if host == 'localhost':
+		port = remapped_ports.get(port, port)
 	try:
-		s = pexpect.spawn('telnet %s %d' % (host, port), logfile=logfile)
+		s = spawn('telnet %s %d' % (host, port), logfile=logfile)
 		s.expect('Connected to ')
 		s.expect('Escape character is')
 		return s
 	except:
 		bad("Cannot access %s:%s" % (host, port))
 
-def netcat(host, port, logfile=sys.stdout):
+def netcat(host, port, logfile=None):
 	"""Connect to a raw socket with automatic failure reporting."""
 	try:
-		return pexpect.spawn('nc %s %d' % (host, port), logfile=logfile)
+		return spawn('nc %s %d' % (host, port), logfile=logfile)
 	except:
 		bad("Cannot access %s:%s" % (host, port))
 
-def fvp(logfile=sys.stdout):
+def fvp(logfile=None):
 	"""Launch fvp and wait for sockets to open, without automatic
 	failure reporting.
 	"""
 
+	built()
+
 	FVP = '/home/drt/Apps/Foundation_Platformpkg' #'-r10p0'
 	FIRMWARE = '/home/drt/Development/Linaro/ARM/16.06/binaries'
 	BUILDROOT = '/home/drt/Development/Buildroot/buildroot-aarch64'
@@ -115,7 +283,7 @@ def fvp(logfile=sys.stdout):
 		      ).format(FVP, FIRMWARE, FIRMWARE, FIRMWARE, BUILDROOT)
 
 		print(cmd)
-		fvp = pexpect.spawn(cmd, logfile=logfile)
+		fvp = spawn(cmd, logfile=logfile)
 
 		fvp.expect('Listening for serial connection on port ([0-9]+)')
                 port = int(fvp.match.group(1))
@@ -136,9 +304,16 @@ def qemu(cmd, logfile=None):
 	argument.
 
 	"""
+	built()
+
+	def remap(m):
+		port = int(m.group(2))
+		remapped_ports[port] = serial_port(port)
+		return m.group(1) + str(remapped_ports[port])
+	cmd = re.sub(r'(-serial tcp:[^:]*:)([0-9]+)', remap, cmd)
 	try:
 		print(cmd)
-		q = pexpect.spawn(cmd, logfile=logfile)
+		q = Session(cmd, logfile=logfile)
 
 		q.expect('QEMU waiting for connection')
                 print("QEMU waiting for connection")
@@ -149,10 +324,11 @@ def qemu(cmd, logfile=None):
 
 def stlinux_arm_boot(cmd, logfile=None):
 	"""Launch stlinux_arm_boot and wait for the kernel to start booting."""
+	built()
 
 	def boot(cmd):
 		print(cmd)
-		g = pexpect.spawn(cmd, logfile=logfile)
+		g = Session(cmd, logfile=logfile)
 		g.expect('Kernel auto-detected')
 		g.expect('Booting')
 		# TODO: recognise SDI.*ERROR and bail out without the timeout
@@ -190,16 +366,20 @@ def cmd(s, cmd):
 def expect_slow_replies(s):
 	s.timeout *= 4
 
+# Messages expected (in order) from every kernel boot
+kernel_boot_messages = (
+	'Booting Linux', # 0.000000
+	'Kernel command line.*$',
+	'Calibrating delay loop...',
+	'NET: Registered protocol family 2',
+	'io scheduler [^ ]* registered .default.',
+	'Freeing unused kernel memory',
+)
+
 def expect_kernel_boot(s, bootloader=()):
 	try:
-		for msg in destringize(bootloader):
+		for msg in tuple(destringize(bootloader)) + kernel_boot_messages:
 			s.expect(msg)
-		s.expect('Booting Linux') # 0.000000
-		s.expect('Kernel command line.*$')
-		s.expect('Calibrating delay loop...')
-		s.expect('NET: Registered protocol family 2')
-		s.expect('io scheduler [^ ]* registered .default.')
-		s.expect('Freeing unused kernel memory')
 	except:
 		bad('Incorrect boot activity messages (kernel)')
 
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+#
+# verdict_farm.py
+#
+# Run several verdicts at once (each booting its own copy of QEMU)
+#
+
+#
+# Usage:
+#
+#   <change into a kernel source directory>
+#
+#   Test several candidate commits at once (multi-point bisection):
+#
+#     <path_to>/verdict_farm.py --commit v4.19 --commit HEAD~10 \
+#         --commit HEAD versatile_verdict
+#
+#   Run several verdicts against a single build of the current tree:
+#
+#     <path_to>/verdict_farm.py versatile_verdict versatile_dt_verdict
+#
+# Each verdict builds its own kernel (the DT verdict needs a different
+# configuration to the non-DT one, for example) so every combination of
+# commit and verdict is checked out into a worktree of its own
+# (verdict-farm/) and built using the build steps from that verdict (and
+# the --arg arguments). Without --commit, a single verdict is built in
+# the current tree; several verdicts are given worktrees containing the
+# current tree (including any uncommitted changes).
+#
+# The verdicts are then run against their builds with up to --parallel
+# instances running at once, each with its own serial port and its own
+# log files (the output of the verdict and a compressed capture of the
+# console).
+#
+# The exit code follows the same rules as a single verdict (and so can
+# be used with git bisect run): 1 if any instance was BAD, otherwise 125
+# if any was skipped, otherwise 0.
+#
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+GOOD = 0
+BAD = 1
+SKIP = 125
+
+verdicts = { GOOD: 'GOOD', BAD: 'BAD', SKIP: 'SKIP' }
+
+def verdict_of(exit_code):
+	"""Interpret an exit code the same way git bisect run does."""
+	if exit_code == 0:
+		return GOOD
+	if exit_code == 125:
+		return SKIP
+	return BAD
+
+def worst(codes):
+	if BAD in codes:
+		return BAD
+	if SKIP in codes:
+		return SKIP
+	return GOOD
+
+def find_verdict(name):
+	if os.path.exists(name):
+		return os.path.abspath(name)
+	fname = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+			name + '.py')
+	if os.path.exists(fname):
+		return fname
+	raise Exception('Cannot find verdict: %s' % (name,))
+
+class Instance(object):
+	"""A single verdict run against a single tree."""
+	def __init__(self, tree, name, script, args, logdir):
+		self.tree = tree
+		self.name = name
+		self.script = script
+		self.args = args
+		self.log = os.path.join(logdir, name + '.log')
+		self.console = os.path.abspath(
+				os.path.join(logdir, name + '.console.log.gz'))
+		self.verdict = None
+
+	def run(self, env):
+		env = dict(os.environ, VERDICT_LOG=self.console, **env)
+		env['PYTHONPATH'] = os.pathsep.join(
+			[ os.path.dirname(self.script) ] +
+			[ p for p in (os.environ.get('PYTHONPATH'),) if p ])
+
+		with open(self.log, 'w') as log:
+			exit_code = subprocess.call(
+				[ sys.executable, '-u', self.script ] + self.args,
+				cwd=self.tree, env=env, stdin=open(os.devnull),
+				stdout=log, stderr=subprocess.STDOUT)
+		self.verdict = verdict_of(exit_code)
+		return self.verdict
+
+class Farm(object):
+	def __init__(self, parallel, jobs, port, logdir):
+		self.parallel = parallel
+		self.jobs = jobs
+		self.logdir = logdir
+		self.lock = threading.Lock()
+		self.ports = list(range(port, port + parallel))
+
+	def report(self, instance):
+		with self.lock:
+			print('### %s: %s (see %s) ###' % (instance.name,
+				verdicts[instance.verdict], instance.log))
+			sys.stdout.flush()
+
+	def run_all(self, instances, env):
+		"""Run instances (up to self.parallel at once)."""
+		queue = list(instances)
+
+		def worker():
+			while True:
+				with self.lock:
+					if not queue:
+						return
+					instance = queue.pop(0)
+					port = self.ports.pop(0)
+				try:
+					instance.run(dict(env,
+						VERDICT_INSTANCE=instance.name,
+						VERDICT_SERIAL_PORT=str(port)))
+				finally:
+					with self.lock:
+						self.ports.append(port)
+				self.report(instance)
+
+		threads = [ threading.Thread(target=worker)
+					for i in range(self.parallel) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+	def build(self, recipes, args):
+		"""Build every tree (using the build steps from its verdict)."""
+		builds = [ Instance(tree, 'build-%s-%s' % (name, vname), script,
+					args, self.logdir)
+				for (name, tree, vname, script) in recipes ]
+		self.run_all(builds, {
+			'VERDICT_BUILD_ONLY': '1',
+			'VERDICT_JOBS': str(self.jobs),
+		})
+		return builds
+
+	def boot(self, instances):
+		self.run_all(instances, { 'VERDICT_SKIP_BUILD': '1' })
+
+def git_output(cmd):
+	return subprocess.check_output([ 'git' ] + cmd).decode('UTF-8').strip()
+
+def worktree(commit, topdir, vname):
+	"""Check out commit into a worktree of its own (for verdict vname)."""
+	sha = git_output([ 'rev-parse', '--short', commit + '^{commit}' ])
+	tree = os.path.abspath(os.path.join(topdir, '%s-%s' % (sha, vname)))
+	if os.path.isdir(tree):
+		subprocess.check_call([ 'git', '-C', tree, 'checkout',
+			'--quiet', '--detach', sha ])
+	else:
+		subprocess.check_call([ 'git', 'worktree', 'add', '--detach',
+			tree, sha ])
+	return (sha, tree)
+
+def main(argv):
+	parser = argparse.ArgumentParser(
+		description='Run several verdicts at once')
+	parser.add_argument('--commit', action='append', default=[],
+		help='Commit to test (may be repeated; default: the current tree)')
+	parser.add_argument('--parallel', '-p', type=int, default=4,
+		help='Number of instances to run at once')
+	parser.add_argument('--jobs', '-j', type=int,
+		help='Jobs to give each build (default: shared out between them)')
+	parser.add_argument('--port', type=int, default=5331,
+		help='First serial port to allocate')
+	parser.add_argument('--logdir', default='verdict-farm/logs',
+		help='Where to write the log of each instance')
+	parser.add_argument('--worktrees', default='verdict-farm',
+		help='Where to check out the commits')
+	parser.add_argument('--arg', action='append', default=[],
+		help='Argument to pass to every verdict (may be repeated)')
+	parser.add_argument('verdict', nargs='+',
+		help='Verdict to run (e.g. versatile_verdict)')
+	args = parser.parse_args(argv[1:])
+
+	if not os.path.isdir(args.logdir):
+		os.makedirs(args.logdir)
+
+	scripts = [ (os.path.basename(v).replace('.py', ''), find_verdict(v))
+			for v in args.verdict ]
+
+	# A build recipe is a tree to build and the verdict (and --arg
+	# arguments) that knows how to build it
+	recipes = []
+	if args.commit:
+		for c in args.commit:
+			for (vname, script) in scripts:
+				(sha, tree) = worktree(c, args.worktrees, vname)
+				recipes.append((sha, tree, vname, script))
+	elif len(scripts) == 1:
+		(vname, script) = scripts[0]
+		recipes.append(('current', os.getcwd(), vname, script))
+	else:
+		# git stash create records any uncommitted changes as a commit
+		# without touching the current tree
+		current = git_output([ 'stash', 'create' ]) or 'HEAD'
+		for (vname, script) in scripts:
+			(sha, tree) = worktree(current, args.worktrees, vname)
+			recipes.append(('current', tree, vname, script))
+
+	if not args.jobs:
+		builds = min(args.parallel, len(recipes))
+		args.jobs = max(1, multiprocessing.cpu_count() // builds)
+
+	farm = Farm(args.parallel, args.jobs, args.port, args.logdir)
+	builds = farm.build(recipes, args.arg)
+
+	instances = []
+	for ((name, tree, vname, script), b) in zip(recipes, builds):
+		if b.verdict == GOOD:
+			instances.append(Instance(tree, '%s-%s' % (name, vname),
+					script, args.arg, args.logdir))
+	farm.boot(instances)
+
+	# Aggregate the results for each commit
+	print('\n### SUMMARY ###')
+	results = []
+	names = []
+	for (name, tree, vname, script) in recipes:
+		if name not in names:
+			names.append(name)
+	for name in names:
+		trees = [ tree for (n, tree, vname, script) in recipes
+					if n == name ]
+		codes = [ i.verdict for i in builds + instances
+					if i.tree in trees ]
+		result = worst(codes)
+		results.append(result)
+		print('%-12s %s' % (name, verdicts[result]))
+
+	return worst(results)
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))